@@ -1,12 +1,16 @@
 import os
+import time
 import logging
 import aiohttp
-import aiofiles
 import asyncio
 import json
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 
+from cache_utils import file_hash, get_upload_registry, get_translation_memory
+from lock_utils import KeyedLocks
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -15,129 +19,352 @@ load_dotenv()
 API_WORKFLOW_RUN_URL_PRO = os.getenv("API_WORKFLOW_RUN_URL_PRO")
 API_FILE_UPLOAD_URL_PRO = os.getenv("API_FILE_UPLOAD_URL_PRO")
 
-# --- 異步文件上傳 ---
-async def _upload_single_file_async(session: aiohttp.ClientSession, local_file_path: str, file_type: str, file_content_type: str, api_key: str, user: str) -> Optional[str]:
-    """異步上傳單個文件"""
-    url = API_FILE_UPLOAD_URL_PRO
-    headers = {'Authorization': f'Bearer {api_key}'}
-    file_name = os.path.basename(local_file_path)
-    
-    data = aiohttp.FormData()
-    data.add_field('user', user)
-    data.add_field('type', file_type)
-    
-    try:
-        async with aiofiles.open(local_file_path, 'rb') as f:
-            file_content = await f.read()
-            data.add_field('file', file_content, filename=file_name, content_type=file_content_type)
-            
-            async with session.post(url, headers=headers, data=data) as response:
-                if response.status == 201:
-                    result = await response.json()
-                    file_id = result.get('id')
-                    logger.info(f"文件 {file_name} 上傳成功，ID: {file_id}")
-                    return file_id
-                else:
-                    error_text = await response.text()
-                    logger.error(f"文件 {file_name} 上傳失敗: {response.status} - {error_text}")
-                    return None
-    except Exception as e:
-        logger.error(f"上傳文件 {file_name} 過程中發生異常: {e}", exc_info=True)
-        return None
+DIFY_MAX_CONNECTIONS = int(os.getenv("DIFY_MAX_CONNECTIONS", "20"))  # Dify 共享連接池的總連接數上限
+DIFY_MAX_CONNECTIONS_PER_HOST = int(os.getenv("DIFY_MAX_CONNECTIONS_PER_HOST", "10"))  # 每個主機的連接數上限
+DIFY_KEEPALIVE_SECONDS = float(os.getenv("DIFY_KEEPALIVE_SECONDS", "60"))  # 空閒連接的保活時間(秒)
+DIFY_TIMEOUT_SECONDS = float(os.getenv("DIFY_TIMEOUT_SECONDS", "300"))  # 單次請求的總超時時間(秒),blocking 模式的工作流耗時較長
+DIFY_WORKFLOW_RATE_PER_SECOND = float(os.getenv("DIFY_WORKFLOW_RATE_PER_SECOND", "2"))  # 工作流調用的平均速率上限(次/秒),<=0 時不限速
+DIFY_WORKFLOW_BURST = int(os.getenv("DIFY_WORKFLOW_BURST", "4"))  # 工作流調用允許的突發次數
+DIFY_UPLOAD_MAX_INFLIGHT_MB = float(os.getenv("DIFY_UPLOAD_MAX_INFLIGHT_MB", "64"))  # 同時上傳中的文件總大小上限(MB)
+HK_TRANSLATE_VERSION = os.getenv("HK_TRANSLATE_VERSION", "1")  # HK 回收原因翻譯工作流版本,變更後舊的翻譯記憶不再命中
+
+
+class TokenBucket:
+    """
+    令牌桶限速器 : 以 rate 個/秒的速度補充令牌,最多積累 capacity 個,每次調用前 `acquire()` 消耗一個令牌
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ByteBudget:
+    """
+    全局的在途字節數上限 : `reserve(size)` 在總量超出上限時等待其他上傳完成;單個超過上限的文件在沒有其他在途上傳時放行
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(max_bytes, 1)
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight == 0 or self._in_flight + size <= self.max_bytes)
+            self._in_flight += size
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._in_flight -= size
+                self._condition.notify_all()
+
+
+class DifyClient:
+    """
+    Dify 接口客戶端 : 持有一個長生命週期的 aiohttp.ClientSession,所有上傳和工作流調用復用同一個連接池
+
+    在應用啟動時調用 `start()`、關閉時調用 `close()`;未啟動時首次調用會自動創建 session
+    """
+
+    def __init__(self, workflow_url: str = API_WORKFLOW_RUN_URL_PRO, upload_url: str = API_FILE_UPLOAD_URL_PRO,
+                 max_connections: int = DIFY_MAX_CONNECTIONS, max_connections_per_host: int = DIFY_MAX_CONNECTIONS_PER_HOST,
+                 keepalive_seconds: float = DIFY_KEEPALIVE_SECONDS, timeout_seconds: float = DIFY_TIMEOUT_SECONDS,
+                 workflow_rate: float = DIFY_WORKFLOW_RATE_PER_SECOND, workflow_burst: int = DIFY_WORKFLOW_BURST,
+                 upload_max_inflight_mb: float = DIFY_UPLOAD_MAX_INFLIGHT_MB):
+        self.workflow_url = workflow_url
+        self.upload_url = upload_url
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_seconds = keepalive_seconds
+        self.timeout_seconds = timeout_seconds
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 所有工作流調用(包括重試)共用一個令牌桶,使並發的批次/分片整體不超過 Dify 的調用配額
+        self.workflow_limiter = TokenBucket(workflow_rate, workflow_burst)
+        # 上傳從文件句柄流式讀取,並限制同時在途的總字節數,峰值內存與批次大小無關
+        self.upload_budget = ByteBudget(int(upload_max_inflight_mb * 1024 * 1024))
+        # 按 (內容哈希, 作用域) 串行化 "查詢登記表 -> 上傳 -> 登記",相同文件的並發上傳只執行一次
+        self._upload_locks = KeyedLocks()
+
+    async def start(self) -> aiohttp.ClientSession:
+        """創建共享的 session(已存在則直接返回)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_seconds,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout_seconds)
+            )
+            logger.info(f"Dify 共享連接池已創建,總連接數: {self.max_connections}, 每主機: {self.max_connections_per_host}")
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            logger.info("Dify 共享連接池已關閉")
+
+    # --- 異步文件上傳 ---
+    async def upload_file(self, local_file_path: str, file_type: str, file_content_type: str, api_key: str, user: str) -> Optional[str]:
+        """
+        異步上傳單個文件 : 先按文件內容的 SHA-256 查詢上傳登記表,有效期內內容相同的文件直接返回已有的 upload_file_id
+        """
+        registry = get_upload_registry()
+        scope = registry.make_scope(api_key, user, file_type)
+        try:
+            digest = await asyncio.to_thread(file_hash, local_file_path)
+        except OSError as e:
+            logger.error(f"讀取文件 {local_file_path} 失敗: {e}")
+            return None
+
+        async with self._upload_locks.hold((digest, scope)):
+            file_id = await asyncio.to_thread(registry.get, digest, scope)
+            if file_id:
+                logger.info(f"文件 {os.path.basename(local_file_path)} 內容未變化，復用已上傳的 ID: {file_id}")
+                return file_id
+
+            file_id = await self._upload_file(local_file_path, file_type, file_content_type, api_key, user)
+            if file_id:
+                await asyncio.to_thread(registry.put, digest, scope, file_id)
+            return file_id
+
+    async def _upload_file(self, local_file_path: str, file_type: str, file_content_type: str, api_key: str, user: str) -> Optional[str]:
+        """將文件上傳到 Dify,返回 upload_file_id,失敗時返回 None"""
+        session = await self.start()
+        headers = {'Authorization': f'Bearer {api_key}'}
+        file_name = os.path.basename(local_file_path)
+
+        try:
+            file_size = os.path.getsize(local_file_path)
+            async with self.upload_budget.reserve(file_size):
+                # 以打開的文件句柄作為表單字段,aiohttp 在發送時分塊讀取,無需先把整個文件讀入內存
+                with open(local_file_path, 'rb') as f:
+                    data = aiohttp.FormData()
+                    data.add_field('user', user)
+                    data.add_field('type', file_type)
+                    data.add_field('file', f, filename=file_name, content_type=file_content_type)
+
+                    async with session.post(self.upload_url, headers=headers, data=data) as response:
+                        if response.status == 201:
+                            result = await response.json()
+                            file_id = result.get('id')
+                            logger.info(f"文件 {file_name} 上傳成功，ID: {file_id}")
+                            return file_id
+                        else:
+                            error_text = await response.text()
+                            logger.error(f"文件 {file_name} 上傳失敗: {response.status} - {error_text}")
+                            return None
+        except Exception as e:
+            logger.error(f"上傳文件 {file_name} 過程中發生異常: {e}", exc_info=True)
+            return None
+
+    async def upload_files(self, local_file_path_list: List[str], file_type: str, file_content_type: str, api_key: str, user: str) -> List[str]:
+        """並發上傳文件列表"""
+        if not local_file_path_list:
+            return []
 
-async def upload_files_async(local_file_path_list: List[str], file_type: str, file_content_type: str, api_key: str, user: str) -> List[str]:
-    """並發上傳文件列表"""
-    if not local_file_path_list:
-        return []
-        
-    async with aiohttp.ClientSession() as session:
         tasks = [
-            _upload_single_file_async(session, path, file_type, file_content_type, api_key, user)
+            self.upload_file(path, file_type, file_content_type, api_key, user)
             for path in local_file_path_list
         ]
         results = await asyncio.gather(*tasks)
         # 過濾掉上傳失敗的 None 結果
         return [file_id for file_id in results if file_id is not None]
 
-async def upload_file_pdf_pdf2content(local_file_path_list: List[str], api_key: str, user: str) -> List[str]:
-    """異步上傳PDF文件列表至Dify"""
-    return await upload_files_async(local_file_path_list, 'pdf', 'application/pdf', api_key, user)
+    # --- 異步工作流執行 ---
+    async def run_workflow(self, api_key: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """通用的異步工作流執行器"""
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
 
-async def upload_file_image_pdf2content(local_file_path_list: List[str], api_key: str, user: str) -> List[str]:
-    """異步上傳圖片文件列表至Dify"""
-    # 假設所有圖片都是png，如果不是，需要更複雜的邏輯來判斷mime type
-    return await upload_files_async(local_file_path_list, 'png', 'image/png', api_key, user)
-
-
-# --- 異步工作流執行 ---
-async def _run_workflow_async(api_key: str, data: Dict[str, Any]) -> Dict[str, Any]:
-    """通用的異步工作流執行器"""
-    workflow_url = API_WORKFLOW_RUN_URL_PRO
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(workflow_url, headers=headers, json=data) as response:
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                await self.workflow_limiter.acquire()
+                session = await self.start()
+                async with session.post(self.workflow_url, headers=headers, json=data) as response:
                     if response.status == 200:
                         logger.info("工作流執行成功")
                         return await response.json()
                     else:
                         error_text = await response.text()
                         logger.error(f"工作流執行失敗 (嘗試 {attempt + 1}): {response.status} - {error_text}")
-        except Exception as e:
-            logger.error(f"工作流執行異常 (嘗試 {attempt + 1}): {e}", exc_info=True)
-        
-        if attempt < max_retries - 1:
-            await asyncio.sleep(2) # 重試前等待
-            
-    return {"error": "工作流執行失敗，已達最大重試次數"}
+            except Exception as e:
+                logger.error(f"工作流執行異常 (嘗試 {attempt + 1}): {e}", exc_info=True)
+
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2) # 重試前等待
 
+        return {"error": "工作流執行失敗，已達最大重試次數"}
+
+
+    async def upload_file_pdf_pdf2content(self, local_file_path_list: List[str], api_key: str, user: str) -> List[str]:
+        """異步上傳PDF文件列表至Dify"""
+        return await self.upload_files(local_file_path_list, 'pdf', 'application/pdf', api_key, user)
+
+    async def upload_file_image_pdf2content(self, local_file_path_list: List[str], api_key: str, user: str) -> List[str]:
+        """異步上傳圖片文件列表至Dify"""
+        # 假設所有圖片都是png，如果不是，需要更複雜的邏輯來判斷mime type
+        return await self.upload_files(local_file_path_list, 'png', 'image/png', api_key, user)
+
+    async def run_workflow_pdf_and_image_pdf2content(self, pdf_file_ids: List[str], image_file_ids: List[str], api_key: str, user: str, workflow_id: str = None) -> Dict[str, Any]:
+        """異步執行工作流（PDF和圖片）"""
+        pdf_list = [{"type": "document", "transfer_method": "local_file", "upload_file_id": file_id} for file_id in pdf_file_ids]
+        image_list = [{"type": "image", "transfer_method": "local_file", "upload_file_id": file_id} for file_id in image_file_ids]
+
+        data = {
+            "inputs": {"file_pdf": pdf_list, "file_image": image_list},
+            "response_mode": "blocking",
+            "user": user
+        }
+        if workflow_id:
+            data["workflow_id"] = workflow_id
+
+        return await self.run_workflow(api_key, data)
+
+    async def run_workflow_pdf_pdf2content(self, pdf_file_ids: List[str], api_key: str, user: str, workflow_id: str = None) -> Dict[str, Any]:
+        """異步執行工作流（僅PDF）"""
+        pdf_list = [{"type": "document", "transfer_method": "local_file", "upload_file_id": file_id} for file_id in pdf_file_ids]
+
+        data = {
+            "inputs": {"file_pdf": pdf_list},
+            "response_mode": "blocking",
+            "user": user
+        }
+        if workflow_id:
+            data["workflow_id"] = workflow_id
+
+        return await self.run_workflow(api_key, data)
+
+    async def run_workflow_foodsafety(self, globalId_content_dict_list: List[Dict], globalId_title_dict_list: List[Dict], api_key: str, user: str, workflow_id: str = None) -> Dict[str, Any]:
+        """異步執行foodsafety工作流"""
+        data = {
+            "inputs": {
+                "globalId_content_dict_list": str(globalId_content_dict_list), # 使用json字符串傳遞複雜結構
+                "globalId_title_dict_list": str(globalId_title_dict_list)
+            },
+            "response_mode": "blocking",
+            "user": user
+        }
+        if workflow_id:
+            data["workflow_id"] = workflow_id
+
+        return await self.run_workflow(api_key, data)
+
+
+    async def run_workflow_translate_hk(self, hk_recycling_reason_list: List[str], api_key: str, user: str) -> List[str]:
+        """異步執行香港食物安全中心 recycling_reason 的翻譯工作流,失敗時返回空列表"""
+        data = {
+            "inputs": {
+                "translate_flag": "true",
+                "hk_recycling_reason_list": str(hk_recycling_reason_list),
+                "sys.files": []
+            },
+            "response_mode": "blocking",
+            "user": user
+        }
+        result = await self.run_workflow(api_key, data)
+        translated = result.get("data", {}).get("outputs", {}).get("hk_recycling_reason_list", [])
+        return translated if isinstance(translated, list) else []
+
+    async def translate_hk_recycling_reasons(self, hk_recycling_reason_list: List[str], api_key: str, user: str) -> List[str]:
+        """
+        翻譯香港食物安全中心的 recycling_reason : 先查詢本地翻譯記憶,只有未翻譯過的原文(去重後)才發送給工作流
+
+        Args:
+            hk_recycling_reason_list (list): 原文列表
+            api_key (str): 翻譯工作流(foodsafety - translate)的 API Key
+            user (str): 用戶標識
+
+        Returns:
+            list: 與輸入等長的譯文列表,未能翻譯的條目保留原文
+        """
+        memory = get_translation_memory()
+        kind = f"hk_recycling_reason:v{HK_TRANSLATE_VERSION}"
+        # "--" 和空字符串無需翻譯
+        texts = list(dict.fromkeys(text for text in hk_recycling_reason_list if text and text != "--"))
+        translations = await asyncio.to_thread(memory.get_many, texts, kind)
+        novel = [text for text in texts if text not in translations]
+        logger.info(f"HK recycling_reason 翻譯 : 翻譯記憶命中 {len(texts) - len(novel)} 條, 需要執行工作流 {len(novel)} 條")
+
+        if novel:
+            translated = await self.run_workflow_translate_hk(novel, api_key, user)
+            if len(translated) == len(novel):
+                fresh = dict(zip(novel, translated))
+                await asyncio.to_thread(memory.put_many, fresh, kind)
+                translations.update(fresh)
+            else:
+                logger.error(f"HK recycling_reason 翻譯結果數量不匹配: 發送 {len(novel)} 條, 返回 {len(translated)} 條, 保留原文")
+
+        return [translations.get(text, text) for text in hk_recycling_reason_list]
+
+
+dify_client = DifyClient()
+
+
+async def init_dify_client():
+    """創建共享的 Dify 連接池,需在應用啟動時調用"""
+    return await dify_client.start()
+
+
+async def close_dify_client():
+    """關閉共享的 Dify 連接池,需在應用關閉時調用"""
+    await dify_client.close()
+
+
+# --- 模塊級接口 : 委託給共享的 dify_client ---
+async def upload_files_async(local_file_path_list: List[str], file_type: str, file_content_type: str, api_key: str, user: str) -> List[str]:
+    """並發上傳文件列表"""
+    return await dify_client.upload_files(local_file_path_list, file_type, file_content_type, api_key, user)
+
+async def upload_file_pdf_pdf2content(local_file_path_list: List[str], api_key: str, user: str) -> List[str]:
+    """異步上傳PDF文件列表至Dify"""
+    return await dify_client.upload_file_pdf_pdf2content(local_file_path_list, api_key, user)
+
+async def upload_file_image_pdf2content(local_file_path_list: List[str], api_key: str, user: str) -> List[str]:
+    """異步上傳圖片文件列表至Dify"""
+    return await dify_client.upload_file_image_pdf2content(local_file_path_list, api_key, user)
+
+async def _run_workflow_async(api_key: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """通用的異步工作流執行器"""
+    return await dify_client.run_workflow(api_key, data)
 
 async def run_workflow_pdf_and_image_pdf2content(pdf_file_ids: List[str], image_file_ids: List[str], api_key: str, user: str, workflow_id: str = None) -> Dict[str, Any]:
     """異步執行工作流（PDF和圖片）"""
-    pdf_list = [{"type": "document", "transfer_method": "local_file", "upload_file_id": file_id} for file_id in pdf_file_ids]
-    image_list = [{"type": "image", "transfer_method": "local_file", "upload_file_id": file_id} for file_id in image_file_ids]
-    
-    data = {
-        "inputs": {"file_pdf": pdf_list, "file_image": image_list},
-        "response_mode": "blocking",
-        "user": user
-    }
-    if workflow_id:
-        data["workflow_id"] = workflow_id
-        
-    return await _run_workflow_async(api_key, data)
+    return await dify_client.run_workflow_pdf_and_image_pdf2content(pdf_file_ids, image_file_ids, api_key, user, workflow_id)
 
 async def run_workflow_pdf_pdf2content(pdf_file_ids: List[str], api_key: str, user: str, workflow_id: str = None) -> Dict[str, Any]:
     """異步執行工作流（僅PDF）"""
-    pdf_list = [{"type": "document", "transfer_method": "local_file", "upload_file_id": file_id} for file_id in pdf_file_ids]
-    
-    data = {
-        "inputs": {"file_pdf": pdf_list},
-        "response_mode": "blocking",
-        "user": user
-    }
-    if workflow_id:
-        data["workflow_id"] = workflow_id
-        
-    return await _run_workflow_async(api_key, data)
+    return await dify_client.run_workflow_pdf_pdf2content(pdf_file_ids, api_key, user, workflow_id)
 
 async def run_workflow_foodsafety(globalId_content_dict_list: List[Dict], globalId_title_dict_list: List[Dict], api_key: str, user: str, workflow_id: str = None) -> Dict[str, Any]:
     """異步執行foodsafety工作流"""
-    data = {
-        "inputs": {
-            "globalId_content_dict_list": str(globalId_content_dict_list), # 使用json字符串傳遞複雜結構
-            "globalId_title_dict_list": str(globalId_title_dict_list)
-        },
-        "response_mode": "blocking",
-        "user": user
-    }
-    if workflow_id:
-        data["workflow_id"] = workflow_id
-        
-    return await _run_workflow_async(api_key, data)
\ No newline at end of file
+    return await dify_client.run_workflow_foodsafety(globalId_content_dict_list, globalId_title_dict_list, api_key, user, workflow_id)
+
+async def translate_hk_recycling_reasons(hk_recycling_reason_list: List[str], api_key: str, user: str) -> List[str]:
+    """翻譯香港食物安全中心的 recycling_reason(帶翻譯記憶)"""
+    return await dify_client.translate_hk_recycling_reasons(hk_recycling_reason_list, api_key, user)
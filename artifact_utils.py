@@ -0,0 +1,174 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+from cache_utils import ARTIFACT_STORE_DIR, file_hash, get_artifact_index
+from http_utils import http_fetcher
+from lock_utils import KeyedLocks
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+ARTIFACT_FRESH_HOURS = float(os.getenv("ARTIFACT_FRESH_HOURS", "24"))  # 在此時間內檢查過的 URL 直接使用本地內容,不再發送請求
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """將 src 以硬鏈接的方式放到 dst(已存在時覆蓋),跨文件系統等無法鏈接時退回為複製"""
+    dst_dir = os.path.dirname(dst)
+    if dst_dir:
+        os.makedirs(dst_dir, exist_ok=True)
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return dst
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+class ArtifactStore:
+    """
+    按內容尋址的 PDF 存儲 : PDF 以其 SHA-256 命名保存在 `pdf/` 下,同一份 PDF 無論被多少個條目、URL 引用都只保存一份;
+    由 PDF 派生的頁面圖片以 `{哈希}_{名稱}` 的形式保存在 `derived/` 下,內容相同的 PDF 不再重複轉換
+
+    URL → 哈希的索引(`cache_utils.ArtifactIndex`)記錄 ETag / Last-Modified,已知的 URL 通過條件請求確認內容未變化後不再下載
+    """
+
+    def __init__(self, root: str = ARTIFACT_STORE_DIR, fresh_hours: float = ARTIFACT_FRESH_HOURS):
+        self.root = root
+        self.blob_dir = os.path.join(root, "pdf")
+        self.derived_dir = os.path.join(root, "derived")
+        self.fresh_seconds = fresh_hours * 3600
+        self._url_locks = KeyedLocks()
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, f"{digest}.pdf")
+
+    def derived_path(self, digest: str, name: str) -> str:
+        """返回由內容為 digest 的 PDF 派生的文件路徑,如 derived_path(digest, "1.png")"""
+        os.makedirs(self.derived_dir, exist_ok=True)
+        return os.path.join(self.derived_dir, f"{digest}_{name}")
+
+    def _pages_marker(self, digest: str) -> str:
+        return os.path.join(self.derived_dir, f"{digest}.pages")
+
+    def record_pages(self, digest: str, page_count: int):
+        """記錄內容為 digest 的 PDF 的總頁數,在所有頁面都渲染成功後調用,derived_pages 據此判斷派生圖片是否完整"""
+        os.makedirs(self.derived_dir, exist_ok=True)
+        marker = self._pages_marker(digest)
+        temp_path = f"{marker}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(str(page_count))
+        os.replace(temp_path, marker)
+
+    def derived_pages(self, digest: str, ext: str = "png") -> List[str]:
+        """
+        返回完整的派生頁面圖片 {digest}_1.png, ..., {digest}_{總頁數}.png
+
+        只有 record_pages 記錄過總頁數且每一頁都存在時才視為完整;未記錄頁數(如部分頁面渲染失敗)或有頁面缺失時返回空列表,需要重新渲染
+        """
+        marker = self._pages_marker(digest)
+        try:
+            with open(marker, encoding="utf-8") as f:
+                page_count = int(f.read().strip())
+        except (OSError, ValueError):
+            return []
+
+        pages = [os.path.join(self.derived_dir, f"{digest}_{n}.{ext}") for n in range(1, page_count + 1)]
+        if not pages or not all(os.path.exists(path) for path in pages):
+            return []
+        for path in pages + [marker]:
+            self.touch(path)
+        return pages
+
+    @staticmethod
+    def touch(path: str):
+        """更新文件時間,使清理任務按最近使用時間保留存儲中的文件"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def add_file(self, path: str) -> str:
+        """
+        將本地文件加入存儲(內容已存在時不重複保存)
+
+        Returns:
+            str: 文件內容的 SHA-256
+        """
+        digest = file_hash(path)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            self.touch(blob)
+        else:
+            link_or_copy(path, blob)
+        return digest
+
+    def _store_download(self, temp_path: str) -> str:
+        """將下載完成的臨時文件按內容哈希移入存儲,返回哈希"""
+        digest = file_hash(temp_path)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            os.remove(temp_path)
+            self.touch(blob)
+        else:
+            os.replace(temp_path, blob)
+        return digest
+
+    async def fetch(self, url: str, headers: Optional[Dict[str, str]] = None,
+                    accept: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        獲取 URL 對應的 PDF 並返回其內容哈希 : 最近檢查過的 URL 直接使用本地內容;
+        較早的 URL 帶上 ETag / Last-Modified 發送條件請求,返回 304 時不下載。同一 URL 的並發請求只下載一次
+
+        Raises:
+            FetchError: 下載失敗
+        """
+        async with self._url_locks.hold(url):
+            index = get_artifact_index()
+            entry = await asyncio.to_thread(index.get, url)
+            if entry and os.path.exists(self.blob_path(entry["content_hash"])):
+                digest = entry["content_hash"]
+                if time.time() - entry["checked_at"] < self.fresh_seconds:
+                    logger.info(f"PDF 已在本地存儲中,跳過下載: {url}")
+                    self.touch(self.blob_path(digest))
+                    return digest
+            else:
+                entry = None
+
+            os.makedirs(self.blob_dir, exist_ok=True)
+            temp_path = os.path.join(self.blob_dir, f"download_{uuid.uuid4().hex}.tmp")
+            result = await http_fetcher.fetch_if_changed(
+                url, temp_path,
+                etag=entry["etag"] if entry else None,
+                last_modified=entry["last_modified"] if entry else None,
+                headers=headers, accept=accept
+            )
+            if result is None:
+                logger.info(f"PDF 內容未變化 (304),使用本地存儲: {url}")
+                await asyncio.to_thread(index.touch, url)
+                self.touch(self.blob_path(entry["content_hash"]))
+                return entry["content_hash"]
+
+            digest = await asyncio.to_thread(self._store_download, temp_path)
+            await asyncio.to_thread(index.put, url, digest, result["etag"], result["last_modified"])
+            return digest
+
+    async def fetch_to(self, url: str, output_filename: str, headers: Optional[Dict[str, str]] = None,
+                       accept: Optional[Callable[[str], bool]] = None) -> str:
+        """獲取 URL 對應的 PDF,並以硬鏈接的方式放到 output_filename(保持原有的文件命名)"""
+        digest = await self.fetch(url, headers=headers, accept=accept)
+        return link_or_copy(self.blob_path(digest), output_filename)
+
+
+# 全局共享的 PDF 存儲
+pdf_artifact_store = ArtifactStore()
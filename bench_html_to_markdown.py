@@ -0,0 +1,112 @@
+"""
+`html_to_markdown()` 性能基準測試 : 對比舊版多遍正則實現與當前的單遍流式實現
+
+用法:
+    python bench_html_to_markdown.py                       # 使用模擬的大型 FSIS / 消費者廳頁面
+    python bench_html_to_markdown.py --global-ids ID1 ID2  # 使用上游接口返回的真實頁面
+"""
+import re
+import sys
+import time
+import asyncio
+import argparse
+
+from data_utils import html_to_markdown
+
+
+def legacy_html_to_markdown(html_content):
+    """舊版多遍正則實現,僅用於對比 (`<p>` 的 PDF 前瞻會掃描到文檔末尾,長頁面上為平方級耗時)"""
+    pdf_links = []
+    pdf_pattern = r'<p>.*?<a\s+href="([^"]*\.pdf)"[^>]*>([^<]*)</a>.*?</p>'
+    for match in re.finditer(pdf_pattern, html_content, re.IGNORECASE | re.DOTALL):
+        pdf_links.append(match.group(0))
+
+    for i in range(6, 0, -1):
+        html = re.sub(rf'<h{i}>(.*?)</h{i}>', rf'{"#" * i} \1', html_content, flags=re.DOTALL)
+
+    html = re.sub(r'<b>(.*?)</b>', r'**\1**', html, flags=re.DOTALL)
+    html = re.sub(r'<strong>(.*?)</strong>', r'**\1**', html, flags=re.DOTALL)
+    html = re.sub(r'<i>(.*?)</i>', r'*\1*', html, flags=re.DOTALL)
+    html = re.sub(r'<em>(.*?)</em>', r'*\1*', html, flags=re.DOTALL)
+    html = re.sub(r'<p>(?!.*?\.pdf.*?</p>)(.*?)</p>', r'\1\n', html, flags=re.DOTALL)
+    html = re.sub(r'<br\s*/?>', r'\n', html, flags=re.DOTALL)
+    html = re.sub(r'<ul>(.*?)</ul>', lambda m: re.sub(r'<li>(.*?)</li>', r'* \1', m.group(1), flags=re.DOTALL), html, flags=re.DOTALL)
+    html = re.sub(r'<ol>(.*?)</ol>', lambda m: re.sub(r'<li>(.*?)</li>', lambda n, c=1: f'{c}. {n.group(1)}\n', m.group(1), flags=re.DOTALL), html, flags=re.DOTALL)
+    html = re.sub(r'<(?!a\s+href="[^"]*\.pdf")[^>]*>', '', html)
+    html = html.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&').replace('&quot;', '"').replace('&#39;', "'")
+
+    for pdf_link in pdf_links:
+        if pdf_link not in html:
+            html += f"\n{pdf_link}"
+
+    return html.strip()
+
+
+def build_fsis_page(sections=400):
+    """模擬大型 FSIS 召回頁面 : 大量段落、列表、表格,並在末尾附帶標簽 PDF 鏈接"""
+    parts = ["<h1>Recall 001-2025</h1>"]
+    for i in range(sections):
+        parts.append(f"<h2>Section {i}</h2>")
+        parts.append(f"<p><strong>Establishment number:</strong> EST. {i} &amp; related <em>ready-to-eat</em> products.</p>")
+        parts.append("<ul><li>12-oz. vacuum-packed packages</li><li>Lot codes 1234 &lt;A&gt;</li></ul>")
+        parts.append(f"<table><tr><td>Distribution</td><td>Nationwide {i}</td></tr></table>")
+        parts.append("<p>Consumers with questions can call the hotline.<br/>Members of the media can contact the press office.</p>")
+    parts.append('<p>View the labels <a href="https://www.fsis.usda.gov/sites/default/files/food_label_pdf/2025-07/001-2025-labels.pdf">here</a>.</p>')
+    return "".join(parts)
+
+
+def build_japan_page(sections=400):
+    """模擬大型消費者廳召回頁面 : 全角空格縮進的多行內容"""
+    parts = ["<h1>リコール情報</h1>"]
+    for i in range(sections):
+        parts.append(f"<p>販売地域：全国<br>　店舗 {i}<br>回収理由の詳細：<br>表示欠落のため</p>")
+        parts.append("<ol><li>対象商品</li><li>賞味期限 2025.07.01</li></ol>")
+        parts.append(f"<p><b>お問い合わせ先</b>：電話 0120-000-{i:03d}</p>")
+    return "".join(parts)
+
+
+def bench(name, html, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        legacy_html_to_markdown(html)
+    legacy_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        html_to_markdown(html)
+    stream_time = (time.perf_counter() - start) / repeat
+
+    speedup = legacy_time / stream_time if stream_time else float("inf")
+    print(f"{name:<40} {len(html):>10,} chars   legacy {legacy_time * 1000:>9.1f} ms   streaming {stream_time * 1000:>8.1f} ms   x{speedup:.1f}")
+
+
+async def fetch_pages(global_ids):
+    from data_utils import getData
+    from http_utils import close_http_fetcher
+    try:
+        items = await getData(global_ids)
+    finally:
+        await close_http_fetcher()
+    return [(f"{item.get('from', '')[:20]} {item.get('globalId', '')[:16]}", item.get("content", "")) for item in items]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="html_to_markdown 性能基準測試")
+    parser.add_argument("--global-ids", nargs="*", help="使用上游接口返回的真實頁面")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.global_ids:
+        pages = asyncio.run(fetch_pages(args.global_ids))
+    else:
+        pages = []
+        for sections in (50, 200, 400):
+            pages.append((f"FSIS (simulated, {sections} sections)", build_fsis_page(sections)))
+            pages.append((f"消費者廳 (simulated, {sections} sections)", build_japan_page(sections)))
+
+    for name, html in pages:
+        bench(name, html, args.repeat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import List, Dict, Any, Tuple, Optional
+from dotenv import load_dotenv
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "data/cache/cache.sqlite3")  # 本地持久化緩存的 SQLite 文件
+RECORD_TTL_HOURS = float(os.getenv("RECORD_TTL_HOURS", "24"))  # 召回條目的有效期(小時),過期後重新向上游獲取
+FOODSAFETY_CACHE_TTL_HOURS = float(os.getenv("FOODSAFETY_CACHE_TTL_HOURS", "168"))  # foodsafety 工作流單條結果的有效期(小時)
+DIFY_UPLOAD_TTL_HOURS = float(os.getenv("DIFY_UPLOAD_TTL_HOURS", "24"))  # Dify 上傳文件ID的復用期限(小時),應不超過 Dify 的文件保留時間
+ARTIFACT_STORE_DIR = os.getenv("ARTIFACT_STORE_DIR", "data/artifacts")  # 按內容哈希保存下載的 PDF 及其派生圖片的目錄
+
+
+def content_hash(text: str) -> str:
+    """計算文本的 SHA-256 哈希值"""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def file_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """分塊讀取文件並計算其內容的 SHA-256 哈希值"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SQLiteStore:
+    """
+    基於 SQLite 的本地持久化存儲基類 : 負責連接管理、建表與線程安全
+
+    子類通過 `SCHEMA` 定義自己的表結構;查詢均為同步調用,在事件循環中應通過 `asyncio.to_thread` 執行
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, db_path: str = CACHE_DB_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self.SCHEMA:
+            self._conn.executescript(self.SCHEMA)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RecordStore(SQLiteStore):
+    """
+    召回條目的本地存儲 : 以 globalId 為鍵,保存上游返回的原始條目、整條條目(所有字段)序列化後的哈希值 item_hash(用於跳過未變化條目的重寫)以及獲取時間
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS recall_records (
+            global_id TEXT PRIMARY KEY,
+            item TEXT NOT NULL,
+            item_hash TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str = CACHE_DB_PATH, ttl_hours: float = RECORD_TTL_HOURS):
+        super().__init__(db_path)
+        self.ttl_seconds = ttl_hours * 3600
+        # 舊版本的表中該列名為 content_hash
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(recall_records)")}
+        if "content_hash" in columns:
+            self._conn.execute("ALTER TABLE recall_records RENAME COLUMN content_hash TO item_hash")
+            self._conn.commit()
+
+    def get_many(self, global_ids: List[str]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        """
+        批量讀取條目
+
+        Args:
+            global_ids (list): 需要讀取的 globalId 列表
+
+        Returns:
+            tuple: (fresh, stale)
+                - fresh : 在有效期內的條目 {globalId: item}
+                - stale : 已過期的條目 {globalId: item},上游獲取失敗時可作為兜底
+        """
+        fresh, stale = {}, {}
+        if not global_ids:
+            return fresh, stale
+
+        expire_before = time.time() - self.ttl_seconds
+        placeholders = ",".join("?" for _ in global_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT global_id, item, fetched_at FROM recall_records WHERE global_id IN ({placeholders})",
+                list(global_ids)
+            ).fetchall()
+
+        for global_id, item_json, fetched_at in rows:
+            try:
+                item = json.loads(item_json)
+            except ValueError:
+                continue
+            if fetched_at >= expire_before:
+                fresh[global_id] = item
+            else:
+                stale[global_id] = item
+        return fresh, stale
+
+    def put_many(self, items: List[Dict[str, Any]]) -> List[str]:
+        """
+        批量寫入(或更新)條目,content 為空的條目不寫入
+
+        條目(content、title、url 等全部字段)的哈希值與已保存的相同時只更新獲取時間,不重寫條目
+
+        Returns:
+            list: 新增或任一字段發生變化的 globalId 列表
+        """
+        now = time.time()
+        rows = {
+            item["globalId"]: (item_json, content_hash(item_json))
+            for item in items
+            for item_json in [json.dumps(item, ensure_ascii=False, sort_keys=True)]
+            if isinstance(item, dict) and item.get("globalId") and item.get("content")
+        }
+        if not rows:
+            return []
+        placeholders = ",".join("?" for _ in rows)
+        with self._lock:
+            stored_hashes = dict(self._conn.execute(
+                f"SELECT global_id, item_hash FROM recall_records WHERE global_id IN ({placeholders})",
+                list(rows)
+            ).fetchall())
+            unchanged = [global_id for global_id, (_, digest) in rows.items() if stored_hashes.get(global_id) == digest]
+            changed = [global_id for global_id, (_, digest) in rows.items() if stored_hashes.get(global_id) != digest]
+            self._conn.executemany(
+                "UPDATE recall_records SET fetched_at = ? WHERE global_id = ?",
+                [(now, global_id) for global_id in unchanged]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO recall_records (global_id, item, item_hash, fetched_at) VALUES (?, ?, ?, ?)",
+                [(global_id, rows[global_id][0], rows[global_id][1], now) for global_id in changed]
+            )
+            self._conn.commit()
+        if unchanged:
+            logger.info(f"召回條目未變化 {len(unchanged)} 條(只更新獲取時間), 新增或變化 {len(changed)} 條")
+        return changed
+
+
+class FoodsafetyResultStore(SQLiteStore):
+    """
+    foodsafety 工作流的單條結果緩存 : 以 (globalId, 輸入哈希, 工作流版本) 為鍵,
+    保存該條目的 distribution / recycling_reason / is_or_not_reason 輸出
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS foodsafety_results (
+            global_id TEXT NOT NULL,
+            input_hash TEXT NOT NULL,
+            workflow_version TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (global_id, input_hash, workflow_version)
+        );
+    """
+
+    def __init__(self, db_path: str = CACHE_DB_PATH, ttl_hours: float = FOODSAFETY_CACHE_TTL_HOURS):
+        super().__init__(db_path)
+        self.ttl_seconds = ttl_hours * 3600
+
+    def get_many(self, keys: List[Tuple[str, str]], workflow_version: str) -> Dict[str, Dict[str, Any]]:
+        """
+        批量讀取未過期的結果
+
+        Args:
+            keys (list): [(globalId, 輸入哈希)]
+            workflow_version (str): 工作流版本,版本變更後舊結果不再命中
+
+        Returns:
+            dict: {globalId: {"distribution"/"recycling_reason"/"is_or_not_reason": value}}
+        """
+        results = {}
+        if not keys:
+            return results
+
+        wanted = dict(keys)
+        expire_before = time.time() - self.ttl_seconds
+        placeholders = ",".join("?" for _ in wanted)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT global_id, input_hash, result FROM foodsafety_results "
+                f"WHERE workflow_version = ? AND created_at >= ? AND global_id IN ({placeholders})",
+                [workflow_version, expire_before, *wanted]
+            ).fetchall()
+
+        for global_id, input_hash, result_json in rows:
+            if wanted.get(global_id) != input_hash:
+                continue
+            try:
+                results[global_id] = json.loads(result_json)
+            except ValueError:
+                continue
+        return results
+
+    def put_many(self, entries: List[Tuple[str, str, Dict[str, Any]]], workflow_version: str):
+        """批量寫入結果 : entries 為 [(globalId, 輸入哈希, 結果字典)],空結果不寫入"""
+        now = time.time()
+        rows = [
+            (global_id, input_hash, workflow_version, json.dumps(result, ensure_ascii=False), now)
+            for global_id, input_hash, result in entries
+            if global_id and result
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO foodsafety_results (global_id, input_hash, workflow_version, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+
+class UploadRegistry(SQLiteStore):
+    """
+    Dify 文件上傳登記表 : 以 (文件內容的 SHA-256, 上傳範圍) 為鍵保存 Dify 返回的 upload_file_id,
+    在有效期內內容相同的文件直接復用已有的ID
+
+    上傳範圍由 API Key、用戶和文件類型組成(以哈希保存,不落地明文 Key)
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dify_uploads (
+            file_hash TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            upload_file_id TEXT NOT NULL,
+            uploaded_at REAL NOT NULL,
+            PRIMARY KEY (file_hash, scope)
+        );
+    """
+
+    def __init__(self, db_path: str = CACHE_DB_PATH, ttl_hours: float = DIFY_UPLOAD_TTL_HOURS):
+        super().__init__(db_path)
+        self.ttl_seconds = ttl_hours * 3600
+
+    @staticmethod
+    def make_scope(api_key: str, user: str, file_type: str) -> str:
+        return content_hash(f"{api_key}\x00{user}\x00{file_type}")
+
+    def get(self, digest: str, scope: str) -> Optional[str]:
+        """返回未過期的 upload_file_id,沒有時返回 None"""
+        expire_before = time.time() - self.ttl_seconds
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT upload_file_id FROM dify_uploads WHERE file_hash = ? AND scope = ? AND uploaded_at >= ?",
+                (digest, scope, expire_before)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, digest: str, scope: str, upload_file_id: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dify_uploads (file_hash, scope, upload_file_id, uploaded_at) VALUES (?, ?, ?, ?)",
+                (digest, scope, upload_file_id, time.time())
+            )
+            self._conn.commit()
+
+
+class TranslationMemory(SQLiteStore):
+    """
+    翻譯記憶 : 以 (原文哈希, 翻譯類別) 為鍵保存譯文,相同的原文直接使用本地譯文
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS translations (
+            source_hash TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            translated TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (source_hash, kind)
+        );
+    """
+
+    def get_many(self, source_texts: List[str], kind: str) -> Dict[str, str]:
+        """返回 {原文: 譯文},只包含已有譯文的原文"""
+        hashes = {content_hash(text): text for text in source_texts}
+        if not hashes:
+            return {}
+        placeholders = ",".join("?" for _ in hashes)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT source_hash, translated FROM translations WHERE kind = ? AND source_hash IN ({placeholders})",
+                [kind, *hashes]
+            ).fetchall()
+        return {hashes[source_hash]: translated for source_hash, translated in rows}
+
+    def put_many(self, pairs: Dict[str, str], kind: str):
+        """批量寫入 {原文: 譯文}"""
+        now = time.time()
+        rows = [(content_hash(text), kind, translated, now) for text, translated in pairs.items() if text and translated]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations (source_hash, kind, translated, created_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+
+class ArtifactIndex(SQLiteStore):
+    """
+    URL → 內容哈希的索引 : 記錄每個 URL 最近一次下載內容的 SHA-256 以及服務器返回的 ETag / Last-Modified,
+    用於發送條件請求,內容未變化時不再重新下載
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS artifact_urls (
+            url TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            checked_at REAL NOT NULL
+        );
+    """
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """返回 {"content_hash", "etag", "last_modified", "checked_at"},沒有記錄時返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, etag, last_modified, checked_at FROM artifact_urls WHERE url = ?",
+                (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"content_hash": row[0], "etag": row[1], "last_modified": row[2], "checked_at": row[3]}
+
+    def put(self, url: str, digest: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifact_urls (url, content_hash, etag, last_modified, checked_at) VALUES (?, ?, ?, ?, ?)",
+                (url, digest, etag, last_modified, time.time())
+            )
+            self._conn.commit()
+
+    def touch(self, url: str):
+        """條件請求確認內容未變化後,更新檢查時間"""
+        with self._lock:
+            self._conn.execute("UPDATE artifact_urls SET checked_at = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+
+
+_stores = {}  # (存儲類, 數據庫路徑) -> 進程內共享的實例
+_stores_lock = threading.Lock()
+
+
+def _get_store(store_cls, db_path: str = CACHE_DB_PATH):
+    """
+    獲取進程內共享的存儲實例(首次調用時創建)
+
+    Args:
+        store_cls: SQLiteStore 的子類
+        db_path: SQLite 文件路徑
+
+    Returns:
+        同一 (store_cls, db_path) 下始終返回同一個實例
+    """
+    key = (store_cls, db_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = store_cls(db_path)
+        return store
+
+
+def get_record_store() -> RecordStore:
+    """獲取進程內共享的 RecordStore"""
+    return _get_store(RecordStore)
+
+
+def get_foodsafety_store() -> FoodsafetyResultStore:
+    """獲取進程內共享的 FoodsafetyResultStore"""
+    return _get_store(FoodsafetyResultStore)
+
+
+def get_upload_registry() -> UploadRegistry:
+    """獲取進程內共享的 UploadRegistry"""
+    return _get_store(UploadRegistry)
+
+
+def get_translation_memory() -> TranslationMemory:
+    """獲取進程內共享的 TranslationMemory"""
+    return _get_store(TranslationMemory)
+
+
+def get_artifact_index() -> ArtifactIndex:
+    """獲取進程內共享的 ArtifactIndex"""
+    return _get_store(ArtifactIndex)
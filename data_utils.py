@@ -1,24 +1,94 @@
 import re
-import httpx
+from html.parser import HTMLParser
+import asyncio
 import logging
-import requests
-from typing import List, Dict
 import os
-import time
+from dotenv import load_dotenv
+from cache_utils import get_record_store
+from http_utils import http_fetcher
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def getData(globalIds):
+load_dotenv()
+EGRAPHQL_URL = "http://api.ersinfotech.com/helper-api/egraphql"
+EGRAPHQL_DOCID = "6836d0c544c8650f3e66334c"
+GETDATA_CHUNK_SIZE = int(os.getenv("GETDATA_CHUNK_SIZE", "50"))  # 每次 GraphQL 請求包含的 globalId 數量
+GETDATA_MAX_CONCURRENT = int(os.getenv("GETDATA_MAX_CONCURRENT", "4"))  # 分塊請求的最大並發數
+
+
+async def _fetch_chunk(globalIds):
+    """向上游 egraphql 接口請求一批 globalId 的原始數據 (經由共享的 http_fetcher,按主機策略限流和重試)"""
+    res = await http_fetcher.fetch_json(
+        EGRAPHQL_URL,
+        method="POST",
+        json_body={
+            "docid": EGRAPHQL_DOCID,
+            "variables": {
+                "globalId": globalIds
+            }
+        })
+    return res["data"]["searchByGlobalId"] or []
+
+
+async def fetch_data(globalIds, chunk_size: int = GETDATA_CHUNK_SIZE, max_concurrent: int = GETDATA_MAX_CONCURRENT):
     """
-    獲取原始數據 ： 食品召回產品召回條目
+    分塊並發地獲取原始數據 : 將 globalIds 切分為若干塊,在信號量的限制下並發請求;
+    某一塊失敗時,逐個重試該塊中的 globalId,以定位並隔離有問題的ID
+
+    Args:
+        globalIds (list): 帖子ID列表
+        chunk_size (int): 每塊包含的 globalId 數量
+        max_concurrent (int): 最大並發請求數
+
+    Returns:
+        tuple: (items, failed)
+            - items : 原始數據列表,按 globalIds 的原始順序排列
+            - failed : 獲取失敗的 globalId 及其錯誤信息 {globalId: error}
+    """
+    if not globalIds:
+        return [], {}
+
+    semaphore = asyncio.Semaphore(max_concurrent)
+    items_by_id = {}
+    failed = {}
+
+    async def fetch_with_limit(chunk):
+        async with semaphore:
+            return await _fetch_chunk(chunk)
+
+    async def process_chunk(chunk):
+        try:
+            for item in await fetch_with_limit(chunk):
+                if isinstance(item, dict) and item.get("globalId"):
+                    items_by_id[item["globalId"]] = item
+            return
+        except Exception as e:
+            if len(chunk) == 1:
+                failed[chunk[0]] = f"{type(e).__name__}: {e}"
+                return
+            logger.warning(f"獲取 {len(chunk)} 條原始數據的請求失敗,改為逐條重試: {type(e).__name__}: {e}")
+
+        await asyncio.gather(*[process_chunk([global_id]) for global_id in chunk])
+
+    unique_ids = list(dict.fromkeys(globalIds))
+    chunks = [unique_ids[i:i + chunk_size] for i in range(0, len(unique_ids), chunk_size)]
+    await asyncio.gather(*[process_chunk(chunk) for chunk in chunks])
+
+    items = [items_by_id[global_id] for global_id in globalIds if global_id in items_by_id]
+    return items, failed
+
+
+async def getData(globalIds):
+    """
+    獲取原始數據 ： 食品召回產品召回條目 (異步,分塊並發請求,復用共享的 http_fetcher 連接池)
 
     Args:
         globalIds: 傳入帖子的ID,可以傳入列表
 
     Returns:
-        以列表的形式返回原始數據:
+        以列表的形式返回原始數據(按 globalIds 的順序排列,獲取失敗的ID會記錄日誌並略過):
             [
                 {
                     "globalId": "bmV3c0A2NzA4NDQ5MTFAMjAyNS0wNy0wMVQxNjowMDowMC4wMDBa",
@@ -30,19 +100,91 @@ def getData(globalIds):
                 
             ]  
     """
-    req = httpx.post(
-        url="http://api.ersinfotech.com/helper-api/egraphql",
-        json={
-            "docid": "6836d0c544c8650f3e66334c",
-            "variables": {
-                "globalId": globalIds
-            }
-        })
-
-    res_data = req.json()["data"]["searchByGlobalId"]
-    logger.info(f" 原始數據提取成功！")
+    if isinstance(globalIds, str):
+        globalIds = [globalIds]
+    res_data, failed = await fetch_data(globalIds)
+    for global_id, error in failed.items():
+        logger.error(f"原始數據獲取失敗 - ID: {global_id}: {error}")
+    logger.info(f" 原始數據提取成功！共 {len(res_data)} 條, 失敗 {len(failed)} 條")
     return res_data
 
+
+async def load_records(globalIds):
+    """
+    優先從本地的 RecordStore 讀取召回條目,只有缺失或已過期的 globalId 才向上游請求,並將結果寫回本地
+
+    Args:
+        globalIds (list): 帖子ID列表
+
+    Returns:
+        list: 原始數據列表,按 globalIds 的順序排列(上游與本地都不存在的 globalId 會被略過)
+
+    Raises:
+        RuntimeError: 所有 globalId 均無法獲取
+    """
+    store = get_record_store()
+    fresh, stale = await asyncio.to_thread(store.get_many, globalIds)
+    missing_ids = [global_id for global_id in globalIds if global_id not in fresh]
+
+    fetched_by_id = {}
+    if missing_ids:
+        logger.info(f"本地命中 {len(fresh)} 條, 需要向上游獲取 {len(missing_ids)} 條原始數據")
+        fetched, failed = await fetch_data(missing_ids)
+        await asyncio.to_thread(store.put_many, fetched)
+        fetched_by_id = {item.get("globalId"): item for item in fetched}
+        for global_id, error in failed.items():
+            if global_id in stale:
+                logger.error(f"向上游獲取原始數據失敗,使用本地已過期的條目 - ID: {global_id}: {error}")
+            else:
+                logger.error(f"原始數據獲取失敗 - ID: {global_id}: {error}")
+    else:
+        logger.info(f"全部 {len(fresh)} 條原始數據均命中本地存儲")
+
+    records = []
+    for global_id in globalIds:
+        item = fresh.get(global_id) or fetched_by_id.get(global_id) or stale.get(global_id)
+        if item is not None:
+            records.append(item)
+
+    if not records and globalIds:
+        raise RuntimeError("原始數據獲取失敗,沒有任何可用的召回條目")
+    return records
+
+
+async def revalidate_data(raw_data, globalIds):
+    """
+    對已獲取的原始數據進行輕量的重新校驗 : 只重新請求內容可能仍會變化的條目
+    (上游未返回的 globalId,或 content 為空的條目),其餘條目直接復用,避免整批重新下載
+
+    Args:
+        raw_data (list): `getData()` 首次返回的原始數據
+        globalIds (list): 請求的全部 globalId
+
+    Returns:
+        list: 校驗後的原始數據列表,保持 raw_data 的原有順序,新補充的條目追加在末尾
+    """
+    raw_data = raw_data or []
+    items_by_id = {item.get("globalId"): item for item in raw_data if isinstance(item, dict)}
+    stale_ids = [
+        global_id for global_id in globalIds
+        if global_id not in items_by_id or not items_by_id[global_id].get("content")
+    ]
+    if not stale_ids:
+        return raw_data
+
+    logger.info(f"重新獲取 {len(stale_ids)} 條內容缺失的原始數據")
+    try:
+        refreshed = await getData(stale_ids) or []
+    except Exception as e:
+        logger.error(f"重新獲取原始數據失敗,沿用首次獲取的結果: {str(e)}")
+        return raw_data
+
+    await asyncio.to_thread(get_record_store().put_many, refreshed)
+    refreshed_by_id = {item.get("globalId"): item for item in refreshed if isinstance(item, dict)}
+    result = [refreshed_by_id.pop(item.get("globalId"), item) if isinstance(item, dict) else item for item in raw_data]
+    result.extend(refreshed_by_id.values())
+    return result
+
 def create_product_dict(data, raw_data):
     """
     將原始產品召回數據轉換為自定義的字典
@@ -84,16 +226,17 @@ def create_product_dict(data, raw_data):
             - urlDict：將全局 ID 映射到產品 URL 的字典
             - fromDict： 將全局 ID 映射到源國的 dict
             - titleDict： 將全局 ID 映射到產品標題的字典
+            - missingGlobalIds：請求中原始數據獲取失敗的全局 ID 列表(不會出現在 globalIds 中)
     """
     myDict = {
         "globalIds": [],
         "imagesByGlobalId": {},
         "urlDict": {},
         "fromDict": {},
-        "titleDict": {}
+        "titleDict": {},
+        "missingGlobalIds": []
     }
 
-    myDict["globalIds"].extend(data["globalIds"])
     myDict["imagesByGlobalId"].update(data["imagesByGlobalId"])
 
     for item in raw_data:
@@ -102,215 +245,282 @@ def create_product_dict(data, raw_data):
         myDict["fromDict"][global_id] = item.get("from","")
         myDict["titleDict"][global_id] = item.get("title","")
 
-    return myDict
+    # 保持請求中的順序 : 原始數據獲取失敗的 globalId 不進入報告,單獨記錄以便調用方查看
+    for global_id in data["globalIds"]:
+        if global_id in myDict["fromDict"]:
+            myDict["globalIds"].append(global_id)
+        else:
+            myDict["missingGlobalIds"].append(global_id)
+    if myDict["missingGlobalIds"]:
+        logger.warning(f"以下 {len(myDict['missingGlobalIds'])} 個 globalId 沒有原始數據,已從報告中略過: {myDict['missingGlobalIds']}")
 
+    return myDict
 
-def add_field(myDict_list, distribution_list, recycling_reason_list):
-    """
-    將 Dify工作流得到的 distribution_list 、 recycling_reason_list 的值添加到 myDict_list 中的每個字典,並確保 "distribution" 字段位於 "products" 字段之前
 
-    Args:
-        myDict_list (list): 數據列表，包含多個字典
-        distribution_list (list): 要添加的分發地區列表
+# 來源名稱標準化 : 完整名稱 -> 標準名稱
+SOURCE_MAPPING = {
+    "The Food Safety Authority of Ireland (FSAI)": "FSAI",
+    "The Food Standards Australia New Zealand (FSANZ)": "FSANZ",
+    "Ministry for Primary Industries (MPI)": "NZ MPI",
+    "Government of Canada": "Government of Canada",
+    "Food Standards Agency": "UK FSA",
+    "The US Food and Drug Administration (FDA)": "US FDA",
+    "The USDA Food Safety and Inspection Service (FSIS)": "US FSIS",
+    "California Department of PublicHealth (CDPH)": "US CDPH",
+    "Food Standards Scotland (FSS)": "FSS",
+    "Food and Agriculture Organization of the United Nations (FAO)": "FAO",
+    "World Organisationfor Animal Health (WOAH)": "WOAH",
+    "World Health Organization (WHO)": "WHO",
+    "Alim'Agri pour Alimentation et Agriculture (The French Ministry of Agriculture and Food)": "The French Ministry of Agriculture and Food",
+    "European food safety authority (EFSA)": "EFSA",
+    "Australian Competition & Consumer Commission (ACCC)": "ACCC",
+    "The Michigan Department of Agriculture and Rural Development (MDARD)": "MDARD",
+    "Oregon Health Authority (OHA)": "OHA",
+    "The Canadian Food Inspection Agency (CFIA)": "CFIA",
+    "消費者廳(Consumer Affairs Agency, Government of Japan)": "Consumer Affairs Agency, Government of Japan"
+}
+
+SOURCE_PATTERNS = {
+    "FSAI": ["food safety authority of ireland", "fsai"],
+    "FSANZ": ["food standards australia", "fsanz"],
+    "NZ MPI": ["ministry for primary industries", "mpi", "new zealand mpi"],
+    "UK FSA": ["food standards agency", "fsa"],
+    "US FDA": ["food and drug administration", "fda"],
+    "US FSIS": ["food safety and inspection service", "fsis"],
+    "US CDPH": ["california department of public health", "cdph"],
+    "FSS": ["food standards scotland", "fss"],
+    "FAO": ["food and agriculture organization of the united nations", "fao"],
+    "WOAH": ["world organisationfor animal health", "woah"],
+    "WHO": ["world health organization", "who"],
+    "The French Ministry of Agriculture and Food": ["alim'agri pour alimentation et agriculture", "the french ministry of agriculture and food"],
+    "EFSA": ["european food safety authority", "efsa"],
+    "ACCC": ["australian competition & consumer commission", "accc"],
+    "MDARD": ["michigan department of agriculture and rural development", "mdard"],
+    "OHA": ["oregon health authority", "oha"],
+    "CFIA": ["canadian food inspection agency", "cfia"],
+    "Consumer Affairs Agency, Government of Japan": ["消費者廳", "consumer affairs agency, government of japan"]
+}
+
+def standardize_source(source):
+    """標准化 source 字段"""
+
+    # 空值處理
+    if not source: 
+        return source
 
-    Returns:
-        list: 更新後的數據列表
-    """
-    myDict_list_add_distribution_recycling_reason = []
-    if len(myDict_list) != len(distribution_list) or len(myDict_list) != len(recycling_reason_list):
-        raise ValueError("myDict_list 和 distribution_list、recycling_reason_list 必須具有相同的長度!distribution字段添加失敗!")
-
-    for i, item in enumerate(myDict_list):
-        new_item = item.copy()
-        new_item["distribution"] = distribution_list[i]
-        new_item["recycling_reason"] = recycling_reason_list[i]
-
-        ordered_item = {
-            "num": new_item["num"],
-            "title": new_item["title"],
-            "url": new_item["url"],
-            "source": new_item["source"],
-            "distribution": new_item["distribution"],
-            "recycling_reason": new_item["recycling_reason"],
-            "products": new_item["products"],
-            "global_id":new_item["global_id"]
-        }
-        myDict_list_add_distribution_recycling_reason.append(ordered_item)
-
-    return myDict_list_add_distribution_recycling_reason
-
-
-def transform_mydict_to_mydict_list_final(
-        myDict,
-        distribution_list,
-        recycling_reason_list,
-        verbose = True
-):
-    """
-    將 `create_product_dict` 函數返回的 myDict 字典轉換為最終的 myDict_list 結構,
-    然後通過 add_field()函數,將 distribution_list 添加到 myDict_list 中；將 recycling_reason_list 添加到 myDict_list 中,
-    最終得到 myDict_list_final
+    # 轉換為小寫比較    
+    source_lower = source.lower()
+    # 首先嘗試完全匹配
+    for full_name, abbreviation in SOURCE_MAPPING.items():
+        if full_name.lower() in source_lower:
+            return abbreviation
+
+    # 如果完全匹配失敗，則嘗試模式匹配
+    for abbreviation, patterns in SOURCE_PATTERNS.items():
+        for pattern in patterns:
+            if pattern in source_lower:
+                return abbreviation
 
-    Args:
-        myDict (dict): create_product_dict()函數返回的自定義字典myDict
-        distribution_list (list): Dify 生成的 distribution_list,後續將用來添加到 myDictFinal_list 的 "distribution" 字段
-        recycling_reason_list (list): Dify 生成的 recycling_reason_list,後續將用來添加到 myDictFinal_list 的 "recycling_reason" 字段
-        verbose (bool): 是否打印詳細日誌 參數控制日誌輸出
+    # 未找到匹配,返回原值
+    return source
 
-    Returns:
-        list: 指定 myDict_list 格式的字典列表
-    """
-    source_mapping = {
-        "The Food Safety Authority of Ireland (FSAI)": "FSAI",
-        "The Food Standards Australia New Zealand (FSANZ)": "FSANZ",
-        "Ministry for Primary Industries (MPI)": "NZ MPI",
-        "Government of Canada": "Government of Canada",
-        "Food Standards Agency": "UK FSA",
-        "The US Food and Drug Administration (FDA)": "US FDA",
-        "The USDA Food Safety and Inspection Service (FSIS)": "US FSIS",
-        "California Department of PublicHealth (CDPH)": "US CDPH",
-        "Food Standards Scotland (FSS)": "FSS",
-        "Food and Agriculture Organization of the United Nations (FAO)": "FAO",
-        "World Organisationfor Animal Health (WOAH)": "WOAH",
-        "World Health Organization (WHO)": "WHO",
-        "Alim'Agri pour Alimentation et Agriculture (The French Ministry of Agriculture and Food)": "The French Ministry of Agriculture and Food",
-        "European food safety authority (EFSA)": "EFSA",
-        "Australian Competition & Consumer Commission (ACCC)": "ACCC",
-        "The Michigan Department of Agriculture and Rural Development (MDARD)": "MDARD",
-        "Oregon Health Authority (OHA)": "OHA",
-        "The Canadian Food Inspection Agency (CFIA)": "CFIA",
-        "消費者廳(Consumer Affairs Agency, Government of Japan)": "Consumer Affairs Agency, Government of Japan"
-    }
 
-    source_patterns = {
-        "FSAI": ["food safety authority of ireland", "fsai"],
-        "FSANZ": ["food standards australia", "fsanz"],
-        "NZ MPI": ["ministry for primary industries", "mpi", "new zealand mpi"],
-        "UK FSA": ["food standards agency", "fsa"],
-        "US FDA": ["food and drug administration", "fda"],
-        "US FSIS": ["food safety and inspection service", "fsis"],
-        "US CDPH": ["california department of public health", "cdph"],
-        "FSS": ["food standards scotland", "fss"],
-        "FAO": ["food and agriculture organization of the united nations", "fao"],
-        "WOAH": ["world organisationfor animal health", "woah"],
-        "WHO": ["world health organization", "who"],
-        "The French Ministry of Agriculture and Food": ["alim'agri pour alimentation et agriculture", "the french ministry of agriculture and food"],
-        "EFSA": ["european food safety authority", "efsa"],
-        "ACCC": ["australian competition & consumer commission", "accc"],
-        "MDARD": ["michigan department of agriculture and rural development", "mdard"],
-        "OHA": ["oregon health authority", "oha"],
-        "CFIA": ["canadian food inspection agency", "cfia"],
-        "Consumer Affairs Agency, Government of Japan": ["消費者廳", "consumer affairs agency, government of japan"]
-    }
+_PDF_ANCHOR_PATTERN = re.compile(r'<a\s+href="[^"]*\.pdf"')
+_BR_PATTERN = re.compile(r'<br\s*/?>')
 
-    def standardize_source(source):
-        """標准化 source 字段"""
+# 成對轉換的行內/塊級標簽 : 標簽名 -> (開始標記, 結束標記)
+_PAIRED_TAG_MARKERS = {
+    "h1": ("# ", ""),
+    "b": ("**", "**"),
+    "strong": ("**", "**"),
+    "i": ("*", "*"),
+    "em": ("*", "*"),
+    "p": ("", "\n"),
+}
+# 列表標簽 -> 列表項的 (開始標記, 結束標記)
+_LIST_ITEM_MARKERS = {
+    "ul": ("* ", ""),
+    "ol": ("1. ", "\n"),
+}
 
-        # 空值處理
-        if not source: 
-            return source
 
-        # 轉換為小寫比較    
-        source_lower = source.lower()
-        # 首先嘗試完全匹配
-        for full_name, abbreviation in source_mapping.items():
-            if full_name.lower() in source_lower:
-                return abbreviation
-            
-        # 如果完全匹配失敗，則嘗試模式匹配
-        for abbreviation, patterns in source_patterns.items():
-            for pattern in patterns:
-                if pattern in source_lower:
-                    return abbreviation
-                
-        # 未找到匹配,返回原值
-        return source
-
-    myDict_list = [
-        {
-            "num": idx + 1,
-            "title": myDict["titleDict"][global_id],
-            "url": myDict["urlDict"][global_id],
-            "source": standardize_source(myDict["fromDict"][global_id]),
-            "products": [],
-            "global_id":global_id
-        }
-        for idx, global_id in enumerate(myDict["globalIds"])
-    ]
+class _MarkdownConverter(HTMLParser):
+    """
+    `html_to_markdown()` 使用的單遍流式轉換器
 
-    # 將 distribution 字段、recycling_reason 字段 添加到 myDict_list 中
-    final_data = add_field(myDict_list=myDict_list,
-                          distribution_list=distribution_list,
-                          recycling_reason_list=recycling_reason_list)
+    只轉換不帶屬性的標簽(與原有正則規則一致),且只有在遇到對應的結束標簽時才寫入 markdown 標記:
+    開始標簽先在輸出中佔位,遇到結束標簽後再回填,未閉合的標簽最終被當作普通標簽去除
+    """
 
-    # 處理 distribution 字段
-    for item in final_data:
-        distribution = item.get("distribution", "")
-        if "全國" in distribution or "全國" in distribution:
-            item["distribution"] = "National"
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.out = []
+        self.pdf_paragraphs = []
+        self._pending = {}  # 標簽名 -> 開始標記在 out 中的佔位下標
+        self._lists = {}  # 列表標簽名 -> 已閉合的列表項 [(開始佔位下標, 結束佔位下標)]
+        self._li = {}  # 列表標簽名 -> 當前未閉合列表項的開始佔位下標
+        self._paragraph_raw = None  # 當前段落的原始 HTML 片段
+        self._paragraph_has_pdf = False
+        self._paragraph_has_pdf_anchor = False  # 段落內是否有以 </a> 閉合、且文字中不含標簽的 PDF 鏈接
+        self._pdf_anchor_open = False  # 段落內的 PDF 鏈接已開始但尚未閉合
+
+    def _raw(self, text):
+        if self._paragraph_raw is not None:
+            self._paragraph_raw.append(text)
+            if ".pdf" in text:
+                self._paragraph_has_pdf = True
+
+    def _placeholder(self):
+        self.out.append("")
+        return len(self.out) - 1
+
+    def handle_starttag(self, tag, attrs):
+        raw = self.get_starttag_text() or ""
+        bare = raw == f"<{tag}>"
+
+        if tag == "p" and bare and "p" not in self._pending:
+            self._paragraph_raw = []
+            self._paragraph_has_pdf = False
+            self._paragraph_has_pdf_anchor = False
+        self._raw(raw)
+        # 與原有正則 `>([^<]*)</a>` 一致 : 鏈接文字中出現其他標簽時不算閉合的 PDF 鏈接
+        self._pdf_anchor_open = False
+
+        if tag in _PAIRED_TAG_MARKERS and bare:
+            if tag not in self._pending:
+                self._pending[tag] = self._placeholder()
+        elif tag in _LIST_ITEM_MARKERS and bare:
+            self._lists.setdefault(tag, [])
+        elif tag == "li" and bare:
+            owner = "ul" if "ul" in self._lists else "ol" if "ol" in self._lists else None
+            if owner and owner not in self._li:
+                self._li[owner] = self._placeholder()
+        elif tag == "br" and _BR_PATTERN.fullmatch(raw):
+            self.out.append("\n")
+        elif tag == "a" and _PDF_ANCHOR_PATTERN.match(raw):
+            # PDF 鏈接的開始標簽原樣保留
+            self.out.append(raw)
+            if self._paragraph_raw is not None:
+                self._pdf_anchor_open = True
+
+    def handle_startendtag(self, tag, attrs):
+        # 自閉合標簽(如 <br/>)只按開始標簽處理
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._raw(f"</{tag}>")
+        if self._pdf_anchor_open and tag == "a":
+            self._paragraph_has_pdf_anchor = True
+        self._pdf_anchor_open = False
+
+        if tag in self._pending:
+            open_idx = self._pending.pop(tag)
+            open_marker, close_marker = _PAIRED_TAG_MARKERS[tag]
+            if tag == "p":
+                # 含有PDF的段落保持原樣,段落原文會在最後追加到結果中
+                if self._paragraph_has_pdf:
+                    if self._paragraph_has_pdf_anchor:
+                        self.pdf_paragraphs.append("".join(self._paragraph_raw))
+                    open_marker, close_marker = "", ""
+                self._paragraph_raw = None
+            self.out[open_idx] = open_marker
+            self.out.append(close_marker)
+        elif tag == "li" and self._li:
+            # <ul> 中的列表項優先配對(與原有正則先處理 <ul> 再處理 <ol> 的順序一致)
+            owner = "ul" if "ul" in self._li else "ol"
+            self._lists[owner].append((self._li.pop(owner), self._placeholder()))
+        elif tag in self._lists:
+            open_marker, close_marker = _LIST_ITEM_MARKERS[tag]
+            for open_idx, close_idx in self._lists.pop(tag):
+                self.out[open_idx] = open_marker
+                self.out[close_idx] = close_marker
+            self._li.pop(tag, None)
+
+    def handle_data(self, data):
+        self._raw(data)
+        self.out.append(data)
+
+    def handle_entityref(self, name):
+        text = f"&{name};"
+        self._raw(text)
+        self.out.append(text)
+
+    def handle_charref(self, name):
+        text = f"&#{name};"
+        self._raw(text)
+        self.out.append(text)
 
-    return final_data
 
 def html_to_markdown(html_content):
     """
     忽略鏈接,圖像等標簽定位,僅提取 `getData` 函數返回的 content 多行字符串文本中的文本內容,但保留PDF鏈接
 
+    基於 html.parser 的單遍流式轉換,耗時與文本長度成線性關係
+
     Args:
         html_content (str): 含有鏈接,圖像等標簽定位的 `getData` 函數返回的多行字符串文本
 
     Returns:
         str: content_cleaned (str): 不含鏈接(除PDF),圖像等標簽定位的,僅有內容的多行字符串文本
     """
-    # 保存PDF鏈接
-    pdf_links = []
-    pdf_pattern = r'<p>.*?<a\s+href="([^"]*\.pdf)"[^>]*>([^<]*)</a>.*?</p>'
-    for match in re.finditer(pdf_pattern, html_content, re.IGNORECASE | re.DOTALL):
-        pdf_links.append(match.group(0))
-
-    # 轉換HTML標簽
-    for i in range(6, 0, -1):
-        html = re.sub(rf'<h{i}>(.*?)</h{i}>', rf'{"#" * i} \1', html_content, flags=re.DOTALL)
-
-    html = re.sub(r'<b>(.*?)</b>', r'**\1**', html, flags=re.DOTALL)
-    html = re.sub(r'<strong>(.*?)</strong>', r'**\1**', html, flags=re.DOTALL)
-    html = re.sub(r'<i>(.*?)</i>', r'*\1*', html, flags=re.DOTALL)
-    html = re.sub(r'<em>(.*?)</em>', r'*\1*', html, flags=re.DOTALL)
-    html = re.sub(r'<p>(?!.*?\.pdf.*?</p>)(.*?)</p>', r'\1\n', html, flags=re.DOTALL)
-    html = re.sub(r'<br\s*/?>', r'\n', html, flags=re.DOTALL)
-    html = re.sub(r'<ul>(.*?)</ul>', lambda m: re.sub(r'<li>(.*?)</li>', r'* \1', m.group(1), flags=re.DOTALL), html, flags=re.DOTALL)
-    html = re.sub(r'<ol>(.*?)</ol>', lambda m: re.sub(r'<li>(.*?)</li>', lambda n, c=1: f'{c}. {n.group(1)}\n', m.group(1), flags=re.DOTALL), html, flags=re.DOTALL)
-    html = re.sub(r'<(?!a\s+href="[^"]*\.pdf")[^>]*>', '', html)
+    converter = _MarkdownConverter()
+    converter.feed(html_content or "")
+    converter.close()
+
+    html = "".join(converter.out)
     html = html.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&').replace('&quot;', '"').replace('&#39;', "'")
 
     # 恢復PDF鏈接
-    for pdf_link in pdf_links:
+    for pdf_link in converter.pdf_paragraphs:
         if pdf_link not in html:
             html += f"\n{pdf_link}"
 
-    return html.strip() 
+    return html.strip()
+
+
+class ParsedDocument:
+    """
+    單條召回條目 content 的解析結果 : 每條條目只解析一次,供所有提取器共享
 
-def clean_old_files(base_paths: List[str], file_patterns: List[str], hours: int = 1):
+    Attributes:
+        html (str): 原始的 HTML content
+        markdown (str): `html_to_markdown()` 轉換後的多行文本
+        text (str): 將 markdown 中的換行符、連續空格等折疊為單個空格後的文本(首次訪問時生成)
+        soup (BeautifulSoup): 原始 HTML 的 DOM 樹(首次訪問時生成)
     """
-    定期清理指定目錄下的舊文件
+
+    def __init__(self, html_content):
+        self.html = html_content or ""
+        self.markdown = html_to_markdown(self.html)
+        self._text = None
+        self._soup = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = re.sub(r'\s+', ' ', self.markdown).strip()
+        return self._text
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            from bs4 import BeautifulSoup
+            self._soup = BeautifulSoup(self.html, 'html.parser')
+        return self._soup
+
+
+def parse_documents(raw_data):
+    """
+    為每條原始數據構建 ParsedDocument
 
     Args:
-        base_paths: 需要清理的目錄列表
-        file_patterns: 需要清理的文件类型列表
-        hours: 文件保留时间（小时）
+        raw_data (list): `getData()` 返回的原始數據
+
+    Returns:
+        dict: {globalId: ParsedDocument}
     """
-    timestamp = time.time() - (hours * 3600)
-    
-    for base_path in base_paths:
-        if not os.path.exists(base_path):
-            continue
-            
-        files = os.listdir(base_path)
-        for file in files:
-            if any(file.endswith(pattern) for pattern in file_patterns):
-                file_path = os.path.join(base_path, file)
-                try:
-                    if os.path.getctime(file_path) < timestamp:
-                        os.remove(file_path)
-                        logger.debug(f"已刪除舊文件: {file_path}")
-                except Exception as e:
-                    logger.error(f"刪除文件失敗 {file_path}: {str(e)}")
\ No newline at end of file
+    return {
+        item.get("globalId", ""): ParsedDocument(item.get("content", ""))
+        for item in raw_data
+        if isinstance(item, dict)
+    }
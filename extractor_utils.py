@@ -0,0 +1,389 @@
+import re
+import logging
+from typing import Dict, List
+from bs4 import BeautifulSoup
+
+from data_utils import ParsedDocument, standardize_source
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SourceExtractor:
+    """
+    來源提取器基類 : 針對某一個(標準化後的)來源,從條目中提取 title / distribution / recycling_reason
+
+    新增來源時,繼承該類、設置 `source` 並實現 `extract()`,再使用 `@register_extractor` 註冊即可
+    """
+
+    source = ""  # 標準化後的來源名稱,與 `standardize_source()` 的返回值一致
+
+    def extract(self, item: Dict, doc: ParsedDocument) -> Dict[str, str]:
+        """
+        Args:
+            item (dict): `getData()` 返回的單條原始數據
+            doc (ParsedDocument): 該條目 content 的解析結果
+
+        Returns:
+            dict: 需要覆蓋的字段,鍵為 "title" / "distribution" / "recycling_reason" 中的若干個
+        """
+        raise NotImplementedError
+
+
+# 標準化來源名稱 -> 提取器實例
+EXTRACTOR_REGISTRY: Dict[str, SourceExtractor] = {}
+
+
+def register_extractor(cls):
+    """類裝飾器 : 將提取器註冊到 EXTRACTOR_REGISTRY"""
+    EXTRACTOR_REGISTRY[cls.source] = cls()
+    return cls
+
+
+def extract_local_fields(raw_data: List[Dict], parsed_docs: Dict[str, ParsedDocument]) -> Dict[str, Dict[str, str]]:
+    """
+    對每條原始數據只分派一次 : 根據標準化後的來源找到對應的提取器,返回本地(正則)提取到的字段
+
+    Args:
+        raw_data (list): `getData()` 返回的原始數據
+        parsed_docs (dict): `parse_documents()` 返回的 {globalId: ParsedDocument}
+
+    Returns:
+        dict: {globalId: {"title"/"distribution"/"recycling_reason": value}},沒有提取到任何字段的條目不包含在內
+    """
+    records = {}
+    for item in raw_data:
+        extractor = EXTRACTOR_REGISTRY.get(standardize_source(item.get("from", "")))
+        if extractor is None:
+            continue
+        global_id = item.get("globalId", "")
+        record = extractor.extract(item, parsed_docs.get(global_id) or ParsedDocument(item.get("content", "")))
+        if record:
+            records[global_id] = record
+    return records
+
+
+# RASFF : 通過 content 中 Subject 下的內容拿到對應的 title
+@register_extractor
+class RasffExtractor(SourceExtractor):
+    source = "RASFF"
+    pattern = re.compile(r'<h3>\s*Subject\s*</h3>\s*<p>\s*<span>\s*(.*?)\s*</span>')
+
+    def extract(self, item, doc):
+        try:
+            match = self.pattern.search(doc.html)
+            if match:
+                return {"title": match.group(1).strip()}
+        except:
+            return {"title": "--"}
+        return {}
+
+
+# FDA : 通過去除html標籤的 content 拿到對應的 recycling_reason
+@register_extractor
+class FdaExtractor(SourceExtractor):
+    source = "US FDA"
+    pattern = re.compile(r'Recall Reason Description\s*(.*?)\s*Company Name:')
+
+    def extract(self, item, doc):
+        try:
+            match = self.pattern.search(doc.text)
+            if match:
+                return {"recycling_reason": match.group(1).strip()}
+        except Exception as e:
+            return {"recycling_reason": "--"}
+        return {}
+
+
+# Government of Canada : distribution
+@register_extractor
+class CanadaExtractor(SourceExtractor):
+    source = "Government of Canada"
+    pattern = re.compile(r'Distribution\s*(.*?)\s*Affected', re.DOTALL)
+
+    def extract(self, item, doc):
+        try:
+            match = self.pattern.search(doc.markdown)
+            if match:
+                # 按換行符分割，清理每一行，並過濾掉空行，再使用換行符重新組合
+                lines = match.group(1).split('\n')
+                cleaned_lines = [line.strip() for line in lines if line.strip()]
+                return {"distribution": '\n'.join(cleaned_lines)}
+            return {"distribution": "--"}
+        except:
+            return {"distribution": "--"}
+
+
+def extract_problem_reason(markdown: str) -> str:
+    """提取 `Problem:` 與 `Food safety hazard:` 之間的回收原因(FSANZ / NSW 共用),未匹配時返回 "--" """
+    pattern = r'(?:\*\*)?Problem:\s*(.*?)\s*(?:\*\*)?Food safety hazard:'  # ** 可選
+    match = re.search(pattern, markdown, re.DOTALL)
+    if match:
+        return match.group(1).replace("*", "").strip()
+    return "--"
+
+
+def extract_available_for_sale(markdown: str) -> str:
+    """提取 "Date Marking" 之前所有包含 "available for sale" 的句子作為 distribution(FSANZ / NSW 共用),未匹配時返回 "--" """
+    # 步驟 1: 提取關鍵字 "Date Marking" 之前的所有內容
+    text_before_date_marking = re.split(r'Date Marking', markdown, maxsplit=1, flags=re.IGNORECASE)[0]
+
+    # 步驟 2: 在此基礎上，使用句號 '.' 切分句子，提取所有包含 "available for sale" 的句子
+    keyword_to_find = "available for sale"
+    found_sentences = []
+    for sentence in text_before_date_marking.split('.'):
+        if keyword_to_find in sentence.lower():
+            cleaned_sentence = sentence.strip()
+            if cleaned_sentence:
+                found_sentences.append(cleaned_sentence + ".")
+
+    # 步驟 3: 將所有找到的句子合併成一個字符串，用空格隔開
+    distribution_details = ' '.join(found_sentences)
+    if not distribution_details:
+        return "--"
+
+    # 步驟 4: 匹配 "The product(s) have been" 或 "The products have been"（忽略大小寫)
+    # 如果匹配項前面有實質性內容，則僅保留從匹配項開始的內容
+    match = re.search(r'The product\(s\) have been|The products have been', distribution_details, re.IGNORECASE)
+    if match and distribution_details[:match.start()].strip():
+        distribution_details = distribution_details[match.start():]
+    return distribution_details
+
+
+# The Food Standards Australia New Zealand (FSANZ) : recycling_reason 和 distribution
+@register_extractor
+class FsanzExtractor(SourceExtractor):
+    source = "FSANZ"
+
+    def extract(self, item, doc):
+        record = {}
+        try:
+            record["recycling_reason"] = extract_problem_reason(doc.markdown)
+        except:
+            record["recycling_reason"] = "--"
+        try:
+            record["distribution"] = extract_available_for_sale(doc.markdown)
+        except:
+            record["distribution"] = "--"
+        return record
+
+
+# NSW Food Authority : 頁面結構與 FSANZ 相同
+@register_extractor
+class NswExtractor(FsanzExtractor):
+    source = "NSW Food Authority"
+
+
+# Ministry for Primary Industries (MPI) : 副標題 recycling_reason 和 distribution
+@register_extractor
+class MpiExtractor(SourceExtractor):
+    source = "NZ MPI"
+    reason_pattern = re.compile(r"<h5><p>(.*?)</p></h5>", re.DOTALL)
+    # 提取Distribution到Notes、Distribution到Point of sale notice for retailers、
+    # Distribution到Point of sale notices for retailers、Distribution到Consumer advice中間的內容
+    distribution_pattern = re.compile(
+        # 匹配 "Distribution" 後，非貪婪地匹配任何字符，直到遇到它的關閉標籤 </td>
+        r"Distribution.*?</td>"
+        # 匹配兩個儲存格之間的空白
+        r"\s*"
+        # 匹配內容儲存格的開始標籤，允許帶有屬性
+        r"<td[^>]*>"
+        # 捕獲我們需要的核心 HTML 內容
+        r"\s*(.*?)\s*"
+        # 匹配內容儲存格的關閉標籤
+        r"</td>"
+        # 非貪婪地匹配直到結束關鍵字
+        r".*?"
+        # 匹配結束關鍵字
+        r"(?:Notes|Point of sale notice for retailers|Consumer advice|Point of sale notices for retailers|Point of sale notice)",
+        re.DOTALL | re.IGNORECASE
+    )
+
+    def extract(self, item, doc):
+        record = {}
+
+        # 副標題在 <h5> </h5> 標記中,直接根據原始 HTML 提取;若包含 "due to",則從該位置截取作為 recycling_reason
+        try:
+            match = self.reason_pattern.search(doc.html)
+            if match:
+                found_reason = match.group(1).strip()
+                if found_reason:
+                    keyword_index = found_reason.find("due to")
+                    record["recycling_reason"] = found_reason[keyword_index:].strip() if keyword_index != -1 else found_reason
+            else:
+                record["recycling_reason"] = "--"
+        except:
+            record["recycling_reason"] = "--"
+
+        try:
+            match = self.distribution_pattern.search(doc.html)
+            if match:
+                # 只解析匹配到的 distribution 儲存格片段
+                soup = BeautifulSoup(match.group(1), 'lxml')
+                # 遍歷每一個<a>標籤並在原地替換為特殊的超鏈接標記
+                for a_tag in soup.find_all('a', href=True):
+                    text = a_tag.get_text(strip=True)
+                    href = a_tag.get('href')
+                    if text and href:
+                        a_tag.replace_with(f"§HYPERLINK§{text}§{href}§")
+                lines = [line.strip() for line in soup.get_text(separator='\n').split('\n') if line.strip()]
+                record["distribution"] = '\n'.join(lines)
+        except Exception as e:
+            logger.error(f"處理 MPI distribution 時出錯，ID: {item.get('globalId')}: {e}")
+            record["distribution"] = "--"
+        return record
+
+
+# Food Standards Agency : distribution 在 <h5> </h5> 標記中
+@register_extractor
+class FsaExtractor(SourceExtractor):
+    source = "UK FSA"
+    pattern = re.compile(r"<h5>(.*?)</h5>", re.DOTALL)
+
+    def extract(self, item, doc):
+        try:
+            match = self.pattern.search(doc.html)
+            if match:
+                return {"distribution": match.group(1).strip()}
+            return {"distribution": "--"}
+        except:
+            return {"distribution": "--"}
+
+
+# Rappel Conso : distribution 和 recycling_reason
+@register_extractor
+class RappelConsoExtractor(SourceExtractor):
+    source = "Rappel Conso"
+    distribution_pattern = re.compile(r"Zone géographique de vente(.*?)Distributeurs(.*?)Informations pratiques concernant le rappel", re.DOTALL)
+    reason_pattern = re.compile(r"Motif du rappel(.*?)Risques encourus par le consommateur", re.DOTALL)
+
+    def extract(self, item, doc):
+        record = {}
+        try:
+            match = self.distribution_pattern.search(doc.markdown)
+            if match:
+                # 將 "銷售區域" 與 "經銷商" 兩個結果進行合並
+                record["distribution"] = f"{match.group(1).strip()} : {match.group(2).strip()}"
+            else:
+                record["distribution"] = "--"
+        except:
+            record["distribution"] = "--"
+
+        try:
+            match = self.reason_pattern.search(doc.markdown)
+            record["recycling_reason"] = match.group(1).strip() if match else "--"
+        except:
+            record["recycling_reason"] = "--"
+        return record
+
+
+# 消費者廳 : distribution 和 recycling_reason (已經被映射為 Consumer Affairs Agency, Government of Japan)
+@register_extractor
+class JapanCaaExtractor(SourceExtractor):
+    source = "Consumer Affairs Agency, Government of Japan"
+    # 主要標記，優先搜索
+    distribution_markers = [
+        "販売地域、販売先：",
+        "販売チャネル：",
+        "販売店舗：",
+        "販売場所：",
+        "販売地域：",
+        "販売先 ：",
+        "販売店 ：",
+        "場所：",
+        "を販売している地区や地域：",
+    ]
+    # 備用標記，僅在未找到主要標記時搜索
+    distribution_markers_fallback = [
+        "その他："
+    ]
+    reason_marker = "回収理由の詳細："
+
+    @staticmethod
+    def _collect_after_markers(lines: List[str], markers: List[str]) -> List[str]:
+        """提取標記冒號之後的內容,以及其後有縮進(全角或半角空格)的連續行"""
+        # 構建正則表達式：匹配標記文本 + 任意空白字符（含全角空格） + 冒號
+        marker_patterns = [re.compile(re.escape(marker.split('：')[0].strip()) + r'\s*：') for marker in markers if '：' in marker]
+        found = []
+        for i, line in enumerate(lines):
+            line_stripped = line.strip()
+            for pattern in marker_patterns:
+                match = pattern.search(line_stripped)
+                if match:
+                    content = line_stripped[match.end():].strip()
+                    if content:
+                        found.append(content)
+
+                    j = i + 1
+                    while j < len(lines):
+                        next_line = lines[j]
+                        if next_line.startswith('　') or next_line.startswith(' '):
+                            extended_content = next_line.strip()
+                            if extended_content:
+                                found.append(extended_content)
+                            j += 1
+                        else:
+                            break
+                    break
+        return found
+
+    def _extract_distribution(self, item, doc, lines):
+        found_distributions = self._collect_after_markers(lines, self.distribution_markers)
+        if not found_distributions:
+            found_distributions = self._collect_after_markers(lines, self.distribution_markers_fallback)
+        if not found_distributions:
+            return "--"
+
+        # 去重，保持順序
+        found_distributions = list(dict.fromkeys(found_distributions))
+
+        # 如果包含 "全國" 或 "全国"，將該項移除，並將 "全国" 添加到列表的最前面
+        for i, dist in enumerate(found_distributions):
+            if "全國" in dist or "全国" in dist:
+                found_distributions.pop(i)
+                found_distributions.insert(0, "全国")
+                break
+
+        distribution_details = "\n".join(found_distributions)
+
+        # 處理 "参照情報をご確認ください。" 的特殊情況 : 從原始 content 中提取鏈接
+        if "参照情報をご確認ください。" in distribution_details:
+            try:
+                link_tag = doc.soup.find('a', string='参照情報')
+                if link_tag and link_tag.get('href'):
+                    # 構造 RichText 可識別的超鏈接格式: §HYPERLINK§顯示文本§URL§剩餘文本
+                    distribution_details = distribution_details.replace("参照情報をご確認ください。", f"§HYPERLINK§参照情報§{link_tag['href']}§")
+            except Exception as e:
+                logger.error(f"提取参照情報鏈接時出錯: {str(e)} - ID: {item.get('globalId')}")
+        return distribution_details
+
+    def _extract_reason(self, lines):
+        found_reasons = []
+        start_collecting = False
+        for line in lines:
+            line_stripped = line.strip()
+            if self.reason_marker in line_stripped:
+                start_collecting = True
+                # 標記同一行的後續內容
+                parts = line_stripped.split(self.reason_marker, 1)
+                if len(parts) > 1 and parts[1].strip():
+                    found_reasons.append(parts[1].strip())
+                continue
+
+            if start_collecting:
+                if not line_stripped:  # 遇到空行停止
+                    break
+                found_reasons.append(line_stripped)
+        return "\n".join(found_reasons) if found_reasons else "--"
+
+    def extract(self, item, doc):
+        try:
+            lines = doc.markdown.split('\n')
+            return {
+                "distribution": self._extract_distribution(item, doc, lines),
+                "recycling_reason": self._extract_reason(lines)
+            }
+        except Exception as e:
+            logger.error(f"Error processing item {item.get('globalId')}: {e}")
+            return {"distribution": "--", "recycling_reason": "--"}
@@ -0,0 +1,391 @@
+import os
+import re
+import json
+import math
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+
+from api_utils import run_workflow_foodsafety
+from cache_utils import content_hash, get_foodsafety_store
+from data_utils import standardize_source
+from merge_utils import resolved_locally, title_needs_is_or_not
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+FOODSAFETY_WORKFLOW_VERSION = os.getenv("FOODSAFETY_WORKFLOW_VERSION", "1")  # foodsafety 工作流版本,工作流變更後修改以使舊緩存失效
+FOODSAFETY_SHARD_MAX_CHARS = int(os.getenv("FOODSAFETY_SHARD_MAX_CHARS", "60000"))  # 每個分片的 content 總字符數上限
+FOODSAFETY_SHARD_MAX_ITEMS = int(os.getenv("FOODSAFETY_SHARD_MAX_ITEMS", "10"))  # 每個分片的條目數上限
+FOODSAFETY_MAX_CONCURRENT = int(os.getenv("FOODSAFETY_MAX_CONCURRENT", "4"))  # 同時執行的分片數量
+FOODSAFETY_SHARD_RETRIES = int(os.getenv("FOODSAFETY_SHARD_RETRIES", "1"))  # 分片失敗後單獨重試的次數
+FOODSAFETY_ITEM_MAX_CHARS = int(os.getenv("FOODSAFETY_ITEM_MAX_CHARS", "8000"))  # 每條 content 發送給工作流的字符數上限
+FOODSAFETY_TRIM_MIN_KEEP_CHARS = 500  # 結束標記出現在該位置之前時不截斷,避免誤刪正文
+
+# 各來源(標準化後的名稱)的 content 裁剪規則 : 從第一個 start 標記開始保留,到其後第一個 end 標記為止(均忽略大小寫)
+# start_line 標記只匹配獨佔一行的標題(可帶 Markdown 的 #/* 前綴和結尾冒號),避免匹配到導航等正文中的同名單詞
+# end 標記之後通常是聯繫方式、消費者建議、頁腳等與 distribution / recycling_reason 無關的內容
+DEFAULT_TRIM_RULE = {
+    "start": [],
+    "end": ["Media enquiries", "Media contact", "Page last updated", "Content current as of"],
+}
+SOURCE_TRIM_RULES = {
+    "US FSIS": {
+        "end": ["FSIS routinely conducts recall effectiveness checks", "Consumers with food safety questions",
+                "Consumers and members of the media with questions"],
+    },
+    "US FDA": {
+        "end": ["Company Contact Information", "Content current as of"],
+    },
+    "UK FSA": {
+        "end": ["About product recalls and withdrawals", "Subscribe to news and alerts"],
+    },
+    "FSS": {
+        "end": ["About product recalls and withdrawals", "Subscribe to"],
+    },
+    "Government of Canada": {
+        "start_line": ["Summary"],
+        "end": ["What you should do", "Media enquiries", "Public enquiries"],
+    },
+    "CFIA": {
+        "start_line": ["Summary"],
+        "end": ["What you should do", "Media enquiries", "Public enquiries"],
+    },
+    "FSAI": {
+        "end": ["Consumers:", "Action Required:"],
+    },
+    "RASFF": {
+        # "Distribution status" 之後正是銷售國家列表,不能作為結束標記
+        "end": ["Measures taken"],
+    },
+}
+
+# foodsafety 工作流的輸出列表 -> 單條結果中對應的字段
+FOODSAFETY_OUTPUT_FIELDS = {
+    "id_distribution_dict_list": "distribution",
+    "id_recyclingReason_dict_list": "recycling_reason",
+    "id_isOrNot_dict_list": "is_or_not_reason",
+}
+
+
+def foodsafety_input_hash(content_item: Dict[str, Any], title: str) -> str:
+    """計算單條條目發送給 foodsafety 工作流的輸入(content、from、title)的哈希值"""
+    payload = json.dumps(
+        {"content": content_item.get("content", ""), "from": content_item.get("from", ""), "title": title},
+        ensure_ascii=False, sort_keys=True
+    )
+    return content_hash(payload)
+
+
+def split_outputs(outputs: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """將工作流輸出的三個列表按 globalId 拆分為單條結果 {globalId: {字段: 值}}"""
+    results: Dict[str, Dict[str, Any]] = {}
+    for output_key, field in FOODSAFETY_OUTPUT_FIELDS.items():
+        for entry in outputs.get(output_key, []) or []:
+            if not isinstance(entry, dict) or field not in entry:
+                continue
+            global_id = entry.get("global_id") or entry.get("globalId")
+            if global_id:
+                results.setdefault(global_id, {})[field] = entry[field]
+    return results
+
+
+def is_complete_result(result: Optional[Dict[str, Any]]) -> bool:
+    """單條結果是否包含工作流的全部輸出字段(distribution、recycling_reason、is_or_not_reason)"""
+    return bool(result) and all(field in result for field in FOODSAFETY_OUTPUT_FIELDS.values())
+
+
+def build_outputs(global_ids: List[str], results: Dict[str, Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """按 global_ids 的順序將單條結果重新組裝為工作流輸出的三個列表"""
+    outputs = {output_key: [] for output_key in FOODSAFETY_OUTPUT_FIELDS}
+    for global_id in global_ids:
+        result = results.get(global_id)
+        if not result:
+            continue
+        for output_key, field in FOODSAFETY_OUTPUT_FIELDS.items():
+            if field in result:
+                outputs[output_key].append({"globalId": global_id, field: result[field]})
+    return outputs
+
+
+def select_foodsafety_items(globalId_content_dict_list: List[Dict], local_field_records: Dict[str, Dict[str, str]]) -> List[Dict]:
+    """
+    去除已由本地提取器完全確定的條目 : distribution 和 recycling_reason 都已在本地確定的條目不再發送完整 content;
+    若生成 title 時仍需要 is_or_not_reason,則以本地提取到的 recycling_reason 作為 content 發送一個精簡條目
+
+    Args:
+        globalId_content_dict_list (list): [{"globalId", "content", "from"}]
+        local_field_records (dict): `extract_local_fields()` 返回的 {globalId: {字段: 值}}
+
+    Returns:
+        list: 需要發送給 foodsafety 工作流的條目列表(順序不變)
+    """
+    selected = []
+    skipped = stubbed = 0
+    chars_before = chars_after = 0
+    for item in globalId_content_dict_list:
+        content = item.get("content", "")
+        chars_before += len(content)
+        source = standardize_source(item.get("from", ""))
+        record = local_field_records.get(item.get("globalId", ""), {})
+
+        if not resolved_locally(source, record):
+            selected.append(item)
+            chars_after += len(content)
+        elif title_needs_is_or_not(source, record):
+            stub = dict(item, content=record.get("recycling_reason", ""))
+            selected.append(stub)
+            chars_after += len(stub["content"])
+            stubbed += 1
+        else:
+            skipped += 1
+
+    if skipped or stubbed:
+        logger.info(f"foodsafety 本地已確定的條目 : 跳過 {skipped} 條, 精簡發送 {stubbed} 條, content 字符數 {chars_before} -> {chars_after}")
+    return selected
+
+
+def _marker_pattern(marker: str) -> str:
+    """標記中的空格匹配任意空白(markdown 中的單詞之間可能有換行或連續空格)"""
+    return r"\s+".join(re.escape(word) for word in marker.split())
+
+
+def _find_marker(text: str, markers: List[str], start: int = 0) -> int:
+    """返回 markers 中任一標記在 text 中(從 start 開始,忽略大小寫)最早出現的位置,找不到時返回 -1"""
+    positions = []
+    for marker in markers:
+        match = re.compile(_marker_pattern(marker), re.IGNORECASE).search(text, start)
+        if match:
+            positions.append(match.start())
+    return min(positions) if positions else -1
+
+
+def _find_line_marker(text: str, markers: List[str]) -> int:
+    """返回 markers 中任一標記作為獨立標題行在 text 中最早出現的位置,找不到時返回 -1(text 需保留換行,即 `ParsedDocument.markdown`)"""
+    positions = []
+    for marker in markers:
+        match = re.search(rf"^[ \t#*]*{_marker_pattern(marker)}[ \t*:]*$", text, re.IGNORECASE | re.MULTILINE)
+        if match:
+            positions.append(match.start())
+    return min(positions) if positions else -1
+
+
+def trim_content(source: str, markdown: str, max_chars: int = FOODSAFETY_ITEM_MAX_CHARS) -> str:
+    """
+    按來源裁剪 content,將換行符、連續空格等折疊為單個空格(與 `ParsedDocument.text` 一致),再按字符上限截斷
+
+    標記在保留換行的 markdown 上查找,start_line 標記才能定位到獨立的標題行
+
+    截斷策略(確定性) : 超過上限時保留開頭 2/3 和結尾 1/3,中間以 " [...] " 連接,
+    召回原因通常在開頭、銷售範圍常在結尾
+
+    Args:
+        source (str): 標準化後的來源名稱
+        markdown (str): `ParsedDocument.markdown`(傳入已折疊的文本時 start_line 標記不生效)
+        max_chars (int): 字符數上限,<=0 時不截斷
+
+    Returns:
+        str: 裁剪後的 content
+    """
+    rule = dict(DEFAULT_TRIM_RULE)
+    rule.update(SOURCE_TRIM_RULES.get(source, {}))
+
+    begin_positions = [pos for pos in (_find_marker(markdown, rule.get("start", [])),
+                                       _find_line_marker(markdown, rule.get("start_line", []))) if pos != -1]
+    begin = min(begin_positions) if begin_positions else 0
+    end = _find_marker(markdown, rule.get("end", []), begin + FOODSAFETY_TRIM_MIN_KEEP_CHARS)
+    trimmed = re.sub(r'\s+', ' ', markdown[begin:end if end != -1 else len(markdown)]).strip()
+
+    if 0 < max_chars < len(trimmed):
+        separator = " [...] "
+        budget = max(max_chars - len(separator), 2)
+        head = budget * 2 // 3
+        tail = budget - head
+        trimmed = f"{trimmed[:head]}{separator}{trimmed[-tail:]}"
+    return trimmed
+
+
+def trim_foodsafety_items(globalId_content_dict_list: List[Dict], parsed_docs: Optional[Dict[str, Any]] = None,
+                          max_chars: int = FOODSAFETY_ITEM_MAX_CHARS) -> List[Dict]:
+    """
+    對每條條目的 content 執行 `trim_content()`,並記錄本次節省的字符/字節數
+
+    Args:
+        globalId_content_dict_list (list): [{"globalId", "content", "from"}],content 為 `ParsedDocument.text`
+        parsed_docs (dict): {globalId: ParsedDocument},content 未被替換(如 `select_foodsafety_items` 的精簡條目)的條目按其 markdown 裁剪
+        max_chars (int): 每條 content 的字符數上限
+    """
+    parsed_docs = parsed_docs or {}
+    trimmed_items = []
+    bytes_before = bytes_after = 0
+    for item in globalId_content_dict_list:
+        content = item.get("content", "")
+        doc = parsed_docs.get(item.get("globalId", ""))
+        source_text = doc.markdown if doc is not None and doc.text == content else content
+        trimmed = trim_content(standardize_source(item.get("from", "")), source_text, max_chars)
+        bytes_before += len(content.encode("utf-8"))
+        bytes_after += len(trimmed.encode("utf-8"))
+        trimmed_items.append(dict(item, content=trimmed))
+
+    if bytes_before:
+        logger.info(f"foodsafety content 裁剪 : {bytes_before} -> {bytes_after} 字節, 節省 {bytes_before - bytes_after} 字節 ({(bytes_before - bytes_after) * 100 / bytes_before:.1f}%)")
+    return trimmed_items
+
+
+def shard_items(items: List[Dict[str, Any]], max_chars: int = FOODSAFETY_SHARD_MAX_CHARS,
+                max_items: int = FOODSAFETY_SHARD_MAX_ITEMS) -> List[List[Dict[str, Any]]]:
+    """
+    按 content 長度將條目分配到大小均衡的分片中
+
+    分片數量由總字符數和條目數上限共同決定;條目按長度從大到小依次放入當前總長度最小的分片,
+    分片內保持條目的原始順序
+
+    Args:
+        items (list): [{"globalId", "content", "from"}]
+        max_chars (int): 每個分片的 content 總字符數上限(單條超長時該分片可超出)
+        max_items (int): 每個分片的條目數上限
+
+    Returns:
+        list: 分片列表
+    """
+    if not items:
+        return []
+    sizes = [len(item.get("content", "")) for item in items]
+    shard_count = max(1, math.ceil(sum(sizes) / max(max_chars, 1)), math.ceil(len(items) / max(max_items, 1)))
+    shard_count = min(shard_count, len(items))
+
+    shards = [[] for _ in range(shard_count)]
+    totals = [0] * shard_count
+    for idx in sorted(range(len(items)), key=lambda i: sizes[i], reverse=True):
+        candidates = [s for s in range(shard_count) if len(shards[s]) < max_items] or range(shard_count)
+        target = min(candidates, key=lambda s: totals[s])
+        shards[target].append(idx)
+        totals[target] += sizes[idx]
+
+    return [[items[idx] for idx in sorted(shard)] for shard in shards if shard]
+
+
+async def run_foodsafety_sharded(globalId_content_dict_list: List[Dict], globalId_title_dict_list: List[Dict],
+                                 api_key: str, user: str, workflow_id: Optional[str] = None,
+                                 max_concurrent: int = FOODSAFETY_MAX_CONCURRENT,
+                                 shard_retries: int = FOODSAFETY_SHARD_RETRIES) -> Dict[str, Dict[str, Any]]:
+    """
+    將條目分片後並發執行 foodsafety 工作流,結果按 globalId 合併;某個分片失敗或遺漏了部分條目時,只重試該分片中缺少結果的條目
+
+    Returns:
+        dict: {globalId: {"distribution"/"recycling_reason"/"is_or_not_reason": value}}
+    """
+    shards = shard_items(globalId_content_dict_list)
+    title_lookup = {item.get("globalId", ""): item for item in globalId_title_dict_list}
+    semaphore = asyncio.Semaphore(max(max_concurrent, 1))
+
+    async def run_shard(shard_idx: int, shard: List[Dict]) -> Dict[str, Dict[str, Any]]:
+        shard_results: Dict[str, Dict[str, Any]] = {}
+        pending = shard
+        for attempt in range(shard_retries + 1):
+            pending_titles = [title_lookup[item.get("globalId", "")] for item in pending if item.get("globalId", "") in title_lookup]
+            async with semaphore:
+                try:
+                    result = await run_workflow_foodsafety(
+                        globalId_content_dict_list=pending,
+                        globalId_title_dict_list=pending_titles,
+                        api_key=api_key, user=user, workflow_id=workflow_id
+                    )
+                    for global_id, fields in split_outputs(result.get('data', {}).get('outputs', {}) or {}).items():
+                        shard_results.setdefault(global_id, {}).update(fields)
+                    if not result.get('data', {}).get('outputs'):
+                        logger.warning(f"foodsafety 分片 {shard_idx + 1}/{len(shards)} 未返回結果 (嘗試 {attempt + 1}): {result.get('error', '')}")
+                except Exception as e:
+                    logger.error(f"foodsafety 分片 {shard_idx + 1}/{len(shards)} 執行出錯 (嘗試 {attempt + 1}): {e}", exc_info=True)
+
+            # 工作流可能只返回分片中的部分條目(或部分字段) : 只重試缺少結果的條目
+            pending = [item for item in pending if not is_complete_result(shard_results.get(item.get("globalId", "")))]
+            if not pending:
+                break
+            if attempt < shard_retries:
+                logger.warning(f"foodsafety 分片 {shard_idx + 1}/{len(shards)} 有 {len(pending)}/{len(shard)} 條缺少結果,重試這些條目")
+        return shard_results
+
+    logger.info(f"foodsafety 工作流 : {len(globalId_content_dict_list)} 條條目分為 {len(shards)} 個分片, 並發數 {max_concurrent}")
+    results: Dict[str, Dict[str, Any]] = {}
+    for shard_results in await asyncio.gather(*(run_shard(i, shard) for i, shard in enumerate(shards))):
+        results.update(shard_results)
+    return results
+
+
+async def run_foodsafety_cached(globalId_content_dict_list: List[Dict], globalId_title_dict_list: List[Dict],
+                                api_key: str, user: str, workflow_id: Optional[str] = None,
+                                workflow_version: str = FOODSAFETY_WORKFLOW_VERSION) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    帶單條結果緩存的 foodsafety 工作流 : 只把緩存未命中的條目分片並發送給 Dify,結果按原始順序合併
+
+    Args:
+        globalId_content_dict_list (list): [{"globalId", "content", "from"}]
+        globalId_title_dict_list (list): [{"globalId", "title"}]
+        api_key (str): foodsafety 工作流的 API Key
+        user (str): 用戶標識
+        workflow_id (str): 可選,指定工作流ID
+        workflow_version (str): 工作流版本,參與緩存鍵
+
+    Returns:
+        dict: 與工作流 outputs 相同結構的 id_distribution_dict_list / id_recyclingReason_dict_list / id_isOrNot_dict_list
+    """
+    store = get_foodsafety_store()
+    title_lookup = {item.get("globalId", ""): item.get("title", "") for item in globalId_title_dict_list}
+    global_ids = [item.get("globalId", "") for item in globalId_content_dict_list]
+    input_hashes = {
+        item.get("globalId", ""): foodsafety_input_hash(item, title_lookup.get(item.get("globalId", ""), ""))
+        for item in globalId_content_dict_list
+    }
+
+    # 只有字段完整的緩存才視為命中,缺少字段的條目重新執行工作流
+    cached = await asyncio.to_thread(store.get_many, list(input_hashes.items()), workflow_version)
+    results = {global_id: result for global_id, result in cached.items() if is_complete_result(result)}
+    missing_content = [item for item in globalId_content_dict_list if item.get("globalId", "") not in results]
+    logger.info(f"foodsafety 緩存命中 {len(results)} 條, 需要執行工作流 {len(missing_content)} 條")
+
+    if missing_content:
+        missing_ids = {item.get("globalId", "") for item in missing_content}
+        missing_title = [item for item in globalId_title_dict_list if item.get("globalId", "") in missing_ids]
+        fresh_results = await run_foodsafety_sharded(
+            globalId_content_dict_list=missing_content,
+            globalId_title_dict_list=missing_title,
+            api_key=api_key, user=user, workflow_id=workflow_id
+        )
+        # 工作流只返回了部分字段的條目本次照常使用但不緩存,避免一次不穩定的執行在緩存有效期內一直缺少字段
+        complete_ids = [global_id for global_id in missing_ids if is_complete_result(fresh_results.get(global_id))]
+        if len(complete_ids) < len(fresh_results):
+            logger.warning(f"foodsafety 有 {len(fresh_results) - len(complete_ids)} 條結果字段不完整,不寫入緩存")
+        await asyncio.to_thread(
+            store.put_many,
+            [(global_id, input_hashes[global_id], fresh_results[global_id]) for global_id in complete_ids],
+            workflow_version
+        )
+        results.update(fresh_results)
+
+    return build_outputs(global_ids, results)
+
+
+if __name__ == "__main__":
+    # 檢查 start_line 標記 : CFIA 頁面導航中的 "Recall summary" 不應被當作正文開頭,應從獨立的 "Summary" 標題行開始保留
+    from data_utils import ParsedDocument
+
+    sample_html = """<nav><ul><li><a href="/recalls">Recalls and safety alerts</a></li><li><a href="/summary">Recall summary archive</a></li></ul></nav>
+<h1>Certain Brand X cheese recalled due to Listeria monocytogenes</h1>
+<p>Type of communication: Recall</p>
+<h2>Summary</h2>
+<p>Product: Cheese</p>
+<p>Issue: Food - Microbial Contamination - Listeria</p>
+<h2>Affected products</h2>
+<p>Distribution: Ontario, Quebec</p>
+<h2>What you should do</h2>
+<p>Check to see if you have recalled products</p>"""
+    doc = ParsedDocument(sample_html)
+    begin = _find_line_marker(doc.markdown, SOURCE_TRIM_RULES["CFIA"]["start_line"])
+    assert begin > doc.markdown.lower().find("summary"), begin
+    trimmed = trim_content("CFIA", doc.markdown, max_chars=0)
+    assert trimmed.startswith("Summary Product: Cheese"), trimmed
+    logger.info(f"start_line 標記位置: {begin}, 裁剪結果: {trimmed}")
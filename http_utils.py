@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+import aiofiles
+from curl_cffi import requests as cffi_requests
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "30"))  # 共享連接池的總連接數上限
+HTTP_DEFAULT_MAX_PER_HOST = int(os.getenv("HTTP_DEFAULT_MAX_PER_HOST", "4"))  # 未單獨配置的主機同時請求數上限
+HTTP_DEFAULT_MIN_INTERVAL_SECONDS = float(os.getenv("HTTP_DEFAULT_MIN_INTERVAL_SECONDS", "0.5"))  # 同一主機兩次請求之間的最小間隔(秒)
+HTTP_DEFAULT_TIMEOUT_SECONDS = float(os.getenv("HTTP_DEFAULT_TIMEOUT_SECONDS", "30"))  # 單次請求的總超時時間(秒)
+HTTP_DEFAULT_RETRIES = int(os.getenv("HTTP_DEFAULT_RETRIES", "2"))  # 失敗後的重試次數
+HTTP_MAX_BODY_MB = float(os.getenv("HTTP_MAX_BODY_MB", "50"))  # 單個響應體的大小上限(MB)
+FSIS_FSA_IMPERSONATE = os.getenv("FSIS_FSA_IMPERSONATE", "chrome120")  # FSIS/FSA 下載模擬的瀏覽器 TLS 指紋
+FSIS_FSA_MAX_PER_HOST = int(os.getenv("FSIS_FSA_MAX_PER_HOST", "4"))  # FSIS/FSA 每個主機同時下載的 PDF 數量上限
+FSIS_FSA_TIMEOUT_SECONDS = float(os.getenv("FSIS_FSA_TIMEOUT_SECONDS", "30"))  # FSIS/FSA 單次下載的超時時間(秒)
+
+# 默認可重試的 HTTP 狀態碼,其餘 4xx 直接失敗
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+CHUNK_SIZE = 64 * 1024
+
+
+class FetchError(Exception):
+    """HTTP 請求最終失敗 : status 為最後一次響應的狀態碼,網絡錯誤時為 None"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class HostPolicy:
+    """
+    單個主機的請求策略
+
+    Args:
+        max_concurrent (int): 同一主機同時進行的請求數上限
+        keepalive_seconds (float): 空閒連接的保活時間,0 表示每次請求後關閉連接
+        impersonate (str): 需要模擬瀏覽器 TLS 指紋時的 curl_cffi 指紋名稱(如 "chrome120"),None 時使用 aiohttp
+        connect_timeout (float): 建立連接的超時時間(秒)
+        total_timeout (float): 單次請求的總超時時間(秒)
+        retries (int): 失敗後的重試次數
+        backoff_base (float): 指數退避的基數(秒),第 n 次重試等待 backoff_base * 2^(n-1) 加隨機抖動
+        backoff_max (float): 單次退避的最長等待時間(秒)
+        max_body_bytes (int): 響應體大小上限,超過時中止下載
+        min_interval (float): 同一主機兩次請求開始之間的最小間隔(秒)
+        verify_ssl (bool): 是否校驗證書,部分政府網站證書鏈不完整,與原下載邏輯一致默認不校驗
+    """
+
+    def __init__(self, max_concurrent: int = HTTP_DEFAULT_MAX_PER_HOST, keepalive_seconds: float = 30,
+                 impersonate: Optional[str] = None, connect_timeout: float = 10,
+                 total_timeout: float = HTTP_DEFAULT_TIMEOUT_SECONDS, retries: int = HTTP_DEFAULT_RETRIES,
+                 backoff_base: float = 1.0, backoff_max: float = 20,
+                 max_body_bytes: int = int(HTTP_MAX_BODY_MB * 1024 * 1024),
+                 min_interval: float = HTTP_DEFAULT_MIN_INTERVAL_SECONDS, verify_ssl: bool = False):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.keepalive_seconds = keepalive_seconds
+        self.impersonate = impersonate
+        self.connect_timeout = connect_timeout
+        self.total_timeout = total_timeout
+        self.retries = max(retries, 0)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_body_bytes = max_body_bytes
+        self.min_interval = min_interval
+        self.verify_ssl = verify_ssl
+
+
+DEFAULT_HOST_POLICY = HostPolicy()
+
+# 各主機的請求策略 : 鍵為主機名或其後綴(匹配自身及所有子域名),最長匹配優先,未列出的主機使用 DEFAULT_HOST_POLICY
+HOST_POLICIES: Dict[str, HostPolicy] = {
+    # 上游 egraphql 接口 : 分塊請求已在 data_utils.fetch_data 中限流,失敗時按條目拆分重試
+    "api.ersinfotech.com": HostPolicy(max_concurrent=8, keepalive_seconds=60, retries=1, min_interval=0, verify_ssl=True),
+    # FSIS / FSA 有 TLS 指紋檢測,需要模擬瀏覽器
+    "fsis.usda.gov": HostPolicy(max_concurrent=FSIS_FSA_MAX_PER_HOST, impersonate=FSIS_FSA_IMPERSONATE,
+                                total_timeout=FSIS_FSA_TIMEOUT_SECONDS, backoff_base=2.0, min_interval=0),
+    "s3-eu-west-1.amazonaws.com": HostPolicy(max_concurrent=FSIS_FSA_MAX_PER_HOST, impersonate=FSIS_FSA_IMPERSONATE,
+                                             total_timeout=FSIS_FSA_TIMEOUT_SECONDS, backoff_base=2.0, min_interval=0),
+    "cdph.ca.gov": HostPolicy(max_concurrent=3, backoff_base=2.0),
+    "cfs.gov.hk": HostPolicy(max_concurrent=3, backoff_base=2.0),
+}
+
+
+def _host_of(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+def _match_policy_key(host: str) -> Optional[str]:
+    """返回 HOST_POLICIES 中與 host 匹配的最長後綴鍵,沒有匹配時返回 None"""
+    best_key = None
+    for key in HOST_POLICIES:
+        if (host == key or host.endswith("." + key)) and (best_key is None or len(key) > len(best_key)):
+            best_key = key
+    return best_key
+
+
+def policy_for(url: str) -> HostPolicy:
+    """返回 url 所屬主機的請求策略"""
+    best_key = _match_policy_key(_host_of(url))
+    return HOST_POLICIES[best_key] if best_key else DEFAULT_HOST_POLICY
+
+
+def policy_key(url: str) -> str:
+    """
+    返回並發和請求間隔限制的分組鍵 : 匹配到 HOST_POLICIES 時為策略鍵(同一策略下的各子域名共用一個限制),
+    否則為主機名本身
+    """
+    host = _host_of(url)
+    return _match_policy_key(host) or host
+
+
+class _Response:
+    """aiohttp / curl_cffi 流式響應的統一封裝"""
+
+    def __init__(self, status: int, headers, chunks, close):
+        self.status = status
+        self.headers = headers
+        self._chunks = chunks
+        self._close = close
+
+    def iter_chunks(self):
+        return self._chunks()
+
+    async def close(self):
+        await self._close()
+
+
+class HttpFetcher:
+    """
+    統一的異步 HTTP 請求層 : 按主機策略限制並發與請求間隔、重試退避、限制響應大小,
+    普通主機共用 aiohttp 連接池,需要模擬瀏覽器指紋的主機共用 curl_cffi AsyncSession
+
+    在應用啟動時調用 `start()`、關閉時調用 `close()`;未啟動時首次請求會自動創建連接池
+    """
+
+    def __init__(self, max_connections: int = HTTP_MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self._aiohttp_sessions: Dict[float, aiohttp.ClientSession] = {}  # 按保活時間區分連接池
+        self._cffi_sessions: Dict[str, Any] = {}  # 按模擬的瀏覽器指紋區分
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}  # 以 policy_key 為鍵
+        self._host_next_slot: Dict[str, float] = {}
+
+    async def start(self):
+        """預先創建默認策略的連接池"""
+        self._aiohttp_session(DEFAULT_HOST_POLICY)
+        logger.info(f"共享 HTTP 請求層已創建,總連接數: {self.max_connections}")
+
+    async def close(self):
+        for session in self._aiohttp_sessions.values():
+            await session.close()
+        for session in self._cffi_sessions.values():
+            await session.close()
+        if self._aiohttp_sessions or self._cffi_sessions:
+            logger.info("共享 HTTP 請求層已關閉")
+        self._aiohttp_sessions.clear()
+        self._cffi_sessions.clear()
+
+    def _aiohttp_session(self, policy: HostPolicy) -> aiohttp.ClientSession:
+        session = self._aiohttp_sessions.get(policy.keepalive_seconds)
+        if session is None or session.closed:
+            if policy.keepalive_seconds > 0:
+                connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=policy.keepalive_seconds,
+                                                 ttl_dns_cache=300)
+            else:
+                connector = aiohttp.TCPConnector(limit=self.max_connections, force_close=True, ttl_dns_cache=300)
+            session = self._aiohttp_sessions[policy.keepalive_seconds] = aiohttp.ClientSession(
+                connector=connector, trust_env=True)
+        return session
+
+    def _cffi_session(self, policy: HostPolicy):
+        session = self._cffi_sessions.get(policy.impersonate)
+        if session is None:
+            session = self._cffi_sessions[policy.impersonate] = cffi_requests.AsyncSession(
+                impersonate=policy.impersonate, max_clients=self.max_connections)
+        return session
+
+    def _host_semaphore(self, host: str, policy: HostPolicy) -> asyncio.Semaphore:
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(policy.max_concurrent)
+        return semaphore
+
+    async def _wait_turn(self, host: str, policy: HostPolicy):
+        """按 min_interval 為同一主機(同一策略鍵)的請求分配開始時間"""
+        if policy.min_interval <= 0:
+            return
+        now = time.monotonic()
+        slot = max(now, self._host_next_slot.get(host, 0.0))
+        self._host_next_slot[host] = slot + policy.min_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _open(self, policy: HostPolicy, method: str, url: str, headers: Optional[Dict[str, str]],
+                    json_body: Any) -> _Response:
+        if policy.impersonate:
+            session = self._cffi_session(policy)
+            response = await session.request(method, url, headers=headers, json=json_body, stream=True,
+                                             timeout=(policy.connect_timeout, policy.total_timeout),
+                                             verify=policy.verify_ssl)
+            return _Response(response.status_code, response.headers, response.aiter_content, response.aclose)
+
+        session = self._aiohttp_session(policy)
+        response = await session.request(
+            method, url, headers=headers, json=json_body, ssl=None if policy.verify_ssl else False,
+            timeout=aiohttp.ClientTimeout(total=policy.total_timeout, connect=policy.connect_timeout))
+
+        async def close():
+            response.release()
+
+        return _Response(response.status, response.headers, lambda: response.content.iter_chunked(CHUNK_SIZE), close)
+
+    def _backoff(self, policy: HostPolicy, attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), policy.backoff_max)
+            except ValueError:
+                pass
+        delay = min(policy.backoff_base * (2 ** (attempt - 1)), policy.backoff_max)
+        return delay + random.uniform(0, policy.backoff_base)
+
+    async def _request(self, method: str, url: str, consume: Callable, headers=None, json_body: Any = None,
+                       accept: Optional[Callable[[str], bool]] = None, retry_statuses: Tuple[int, ...] = RETRY_STATUSES):
+        """
+        按主機策略發送請求,並將響應交給 consume(response, policy) 處理;網絡錯誤和可重試狀態碼按策略退避重試
+
+        Args:
+            headers (dict/callable): 請求頭,傳入 callable(attempt) 時每次嘗試生成新的請求頭
+            accept (callable): 可選,根據 content-type 判斷響應是否符合預期,不符合時直接失敗
+        """
+        policy = policy_for(url)
+        host = policy_key(url)
+        last_error: Optional[FetchError] = None
+
+        for attempt in range(policy.retries + 1):
+            retry_after = None
+            async with self._host_semaphore(host, policy):
+                await self._wait_turn(host, policy)
+                try:
+                    response = await self._open(policy, method, url,
+                                                headers(attempt) if callable(headers) else headers, json_body)
+                    try:
+                        if response.status in retry_statuses:
+                            retry_after = response.headers.get("Retry-After")
+                            raise FetchError(f"HTTP {response.status}: {url}", response.status)
+                        if response.status >= 400:
+                            raise FetchError(f"HTTP {response.status}: {url}", response.status)
+                        if response.status == 304:
+                            # 條件請求命中 : 沒有響應體,由 consume 自行處理
+                            return await consume(response, policy)
+                        content_type = response.headers.get("content-type", "")
+                        if accept is not None and not accept(content_type.lower()):
+                            raise FetchError(f"響應類型不符合預期 ({content_type}): {url}", response.status)
+                        content_length = response.headers.get("content-length")
+                        if content_length and content_length.isdigit() and int(content_length) > policy.max_body_bytes:
+                            raise FetchError(f"響應體過大 ({content_length} bytes): {url}", response.status)
+                        return await consume(response, policy)
+                    finally:
+                        await response.close()
+                except FetchError as e:
+                    if e.status is not None and e.status not in retry_statuses:
+                        raise
+                    last_error = e
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    last_error = FetchError(f"{type(e).__name__}: {e}")
+
+            if attempt < policy.retries:
+                delay = self._backoff(policy, attempt + 1, retry_after)
+                logger.warning(f"請求失敗,{delay:.1f} 秒後重試({attempt + 1}/{policy.retries}): {last_error}")
+                await asyncio.sleep(delay)
+
+        raise last_error
+
+    @staticmethod
+    async def _write_body(response: _Response, policy: HostPolicy, url: str, output_filename: str) -> str:
+        """將響應體分塊寫入臨時文件,完成後再原子地重命名,中途失敗不會留下不完整的文件"""
+        temp_filename = f"{output_filename}.part"
+        received = 0
+        try:
+            async with aiofiles.open(temp_filename, 'wb') as f:
+                async for chunk in response.iter_chunks():
+                    received += len(chunk)
+                    if received > policy.max_body_bytes:
+                        raise FetchError(f"響應體超過 {policy.max_body_bytes} bytes: {url}", response.status)
+                    await f.write(chunk)
+            if received == 0:
+                raise FetchError(f"響應內容為空: {url}", response.status)
+            os.replace(temp_filename, output_filename)
+            return output_filename
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+
+    async def fetch_to_file(self, url: str, output_filename: str, headers=None,
+                            accept: Optional[Callable[[str], bool]] = None,
+                            retry_statuses: Tuple[int, ...] = RETRY_STATUSES) -> str:
+        """
+        下載文件 : 響應分塊寫入臨時文件,完成後再原子地重命名
+
+        Returns:
+            str: 保存的文件路徑,最終失敗時拋出 FetchError
+        """
+
+        async def consume(response: _Response, policy: HostPolicy) -> str:
+            return await self._write_body(response, policy, url, output_filename)
+
+        return await self._request("GET", url, consume, headers=headers, accept=accept, retry_statuses=retry_statuses)
+
+    async def fetch_if_changed(self, url: str, output_filename: str, etag: Optional[str] = None,
+                               last_modified: Optional[str] = None, headers: Optional[Dict[str, str]] = None,
+                               accept: Optional[Callable[[str], bool]] = None) -> Optional[Dict[str, Optional[str]]]:
+        """
+        條件下載 : 帶上 If-None-Match / If-Modified-Since,服務器返回 304 時不寫入文件
+
+        Returns:
+            dict/None: 304 時返回 None;否則返回 {"path", "etag", "last_modified"},最終失敗時拋出 FetchError
+        """
+        request_headers = dict(headers or {})
+        if etag:
+            request_headers["If-None-Match"] = etag
+        if last_modified:
+            request_headers["If-Modified-Since"] = last_modified
+
+        async def consume(response: _Response, policy: HostPolicy):
+            if response.status == 304:
+                return None
+            path = await self._write_body(response, policy, url, output_filename)
+            return {"path": path, "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+        return await self._request("GET", url, consume, headers=request_headers, accept=accept)
+
+    async def fetch_bytes(self, url: str, method: str = "GET", headers=None, json_body: Any = None) -> bytes:
+        """讀取完整響應體(受 max_body_bytes 限制)"""
+
+        async def consume(response: _Response, policy: HostPolicy) -> bytes:
+            body = bytearray()
+            async for chunk in response.iter_chunks():
+                body.extend(chunk)
+                if len(body) > policy.max_body_bytes:
+                    raise FetchError(f"響應體超過 {policy.max_body_bytes} bytes: {url}", response.status)
+            return bytes(body)
+
+        return await self._request(method, url, consume, headers=headers, json_body=json_body)
+
+    async def fetch_json(self, url: str, method: str = "GET", headers=None, json_body: Any = None) -> Any:
+        return json.loads(await self.fetch_bytes(url, method=method, headers=headers, json_body=json_body))
+
+
+# 全局共享的 HTTP 請求層
+http_fetcher = HttpFetcher()
+
+
+async def init_http_fetcher():
+    """在應用啟動時創建共享的 HTTP 連接池"""
+    await http_fetcher.start()
+    return http_fetcher
+
+
+async def close_http_fetcher():
+    """在應用關閉時釋放共享的 HTTP 連接池"""
+    await http_fetcher.close()
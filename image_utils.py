@@ -2,27 +2,29 @@ import os
 import random
 import logging
 import asyncio
-import aiohttp
-import aiofiles
 from PIL import Image
 from typing import List, Optional
 from urllib.parse import urlparse
+from http_utils import http_fetcher, FetchError, RETRY_STATUSES
+from artifact_utils import link_or_copy
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 圖片站點的 403 多為防盜鏈,更換 Referer 後重試
+IMAGE_RETRY_STATUSES = RETRY_STATUSES + (403,)
+
+
 async def download_images_with_timestamp(
         myDict,
         images_dir="data/images",
-        download_delay=3,
         verbose=True,
-        max_retries=3,
         max_concurrent=5
 ):
     """
     异步下载图片并保存到指定目录，如果图片已存在则跳过下载
-    增强的反反爬虫措施
+    增强的反反爬虫措施 : 經由共享的 http_fetcher 下載,同一主機的並發、請求間隔和重試退避由 http_utils 中的主機策略統一控制
 
     Args:
         myDict (dict): 自定义的myDict字典,包含图片URL的数据结构，格式如：
@@ -34,10 +36,8 @@ async def download_images_with_timestamp(
                 }
             }
         images_dir (str): 基础存储目录（默认当前路径下的images文件夹）
-        download_delay (int): 下载间隔秒数（防封IP）
         verbose (bool): 是否打印详细日志
-        max_retries (int): 下载失败时的最大重试次数
-        max_concurrent (int): 最大并发下载数量
+        max_concurrent (int): 最大并发下载数量(所有主機合計)
     Returns:
         list: 成功下载的文件路径列表
     """
@@ -75,8 +75,28 @@ async def download_images_with_timestamp(
 
     semaphore = asyncio.Semaphore(max_concurrent)
     
-    async def download_single_image(session: aiohttp.ClientSession, 
-                                  url: str, 
+    def build_headers(url: str, attempt: int) -> dict:
+        """每次嘗試輪換 User-Agent;首次使用圖片所在站點作為 Referer,重試時隨機更換"""
+        headers = {
+            "User-Agent": random.choice(user_agents),
+            "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+            "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
+            "Accept-Encoding": "gzip, deflate, br",
+            "Upgrade-Insecure-Requests": "1",
+            "Sec-Fetch-Site": "cross-site",
+            "Sec-Fetch-Mode": "no-cors",
+            "Sec-Fetch-Dest": "image",
+            "Cache-Control": "no-cache",
+            "Pragma": "no-cache"
+        }
+        if attempt == 0:
+            parsed_url = urlparse(url)
+            headers["Referer"] = f"{parsed_url.scheme}://{parsed_url.netloc}/"
+        else:
+            headers["Referer"] = random.choice(common_referers)
+        return headers
+
+    async def download_single_image(url: str, 
                                   filename: str, 
                                   global_id: str, 
                                   img_idx: int) -> Optional[str]:
@@ -101,122 +121,47 @@ async def download_images_with_timestamp(
                     return alt_filename
                 
         async with semaphore:
-            download_success = False
-            for retry in range(max_retries):
-                try:
-                    base_delay = download_delay
-                    await asyncio.sleep(base_delay)
-
-                    headers = {
-                        "User-Agent": random.choice(user_agents),
-                        "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
-                        "Accept-Language": "en-US,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
-                        "Accept-Encoding": "gzip, deflate, br",
-                        "Connection": "keep-alive",
-                        "Upgrade-Insecure-Requests": "1",
-                        "Sec-Fetch-Site": "cross-site",
-                        "Sec-Fetch-Mode": "no-cors",
-                        "Sec-Fetch-Dest": "image",
-                        "Cache-Control": "no-cache",
-                        "Pragma": "no-cache"
-                    }
-                    
-                    if retry == 0:
-                        parsed_url = urlparse(url)
-                        headers["Referer"] = f"{parsed_url.scheme}://{parsed_url.netloc}/"
-                    else:
-                        headers["Referer"] = random.choice(common_referers)
-
-                    try:
-                        async with session.get(url, 
-                                             headers=headers, 
-                                             timeout=aiohttp.ClientTimeout(total=30),
-                                             ssl=False) as response:
-                            if response.status == 200:
-                                content_type = response.headers.get('content-type', '').lower()
-                                if 'image' not in content_type and content_type != 'application/octet-stream':
-                                    break
-
-                                content = await response.read()
-                                if len(content) > 0:
-                                    async with aiofiles.open(filename, 'wb') as f:
-                                        await f.write(content)
-
-                                    file_size = os.path.getsize(filename)
-                                    if file_size > 0:
-                                        success_files.append(filename)
-                                        download_success = True
-                                        if verbose:
-                                            pass
-                                            # logger.info(f"[SUCCESS] 圖片已保存: {filename} ({file_size} bytes)")
-                                        return filename
-                                    else:
-                                        logger.warning(f"下載的圖片為空: {filename}")
-                                        if os.path.exists(filename):
-                                            os.remove(filename)
-                                else:
-                                    logger.warning(f"響應內容為空,圖片下載失敗: {url}")
-
-                            elif response.status == 403:
-                                logger.warning(f"訪問被拒絕 (HTTP 403),圖片下載失敗: {url}")
-                                await asyncio.sleep(base_delay)
-
-                            elif response.status == 404:
-                                logger.error(f"圖片不存在 (HTTP 404),圖片下載失敗: {url}")
-                                break
-                            else:
-                                logger.warning(f"下載失敗 (HTTP {response.status}),圖片下載失敗: {url}")
-                                await asyncio.sleep(base_delay)
-
-                    except aiohttp.ClientError as e:
-                        logger.error(f"請求錯誤,圖片下載失敗: {url} - {str(e)}")
-                        await asyncio.sleep(1)
-
-                except asyncio.TimeoutError:
-                    logger.warning(f"請求超時,圖片下載失敗: {url}")
-                    await asyncio.sleep(1)
-
-                except Exception as e:
-                    logger.error(f"下載出錯,圖片下載失敗: {url} - {str(e)}")
-                    await asyncio.sleep(1)
-
-            if not download_success:
-                logger.error(f"圖片最終下載失敗: {url}")
+            try:
+                await http_fetcher.fetch_to_file(
+                    url, filename,
+                    headers=lambda attempt: build_headers(url, attempt),
+                    accept=lambda content_type: 'image' in content_type or content_type == 'application/octet-stream',
+                    retry_statuses=IMAGE_RETRY_STATUSES
+                )
+                success_files.append(filename)
+                return filename
+            except FetchError as e:
+                logger.error(f"圖片最終下載失敗: {url} - {str(e)}")
                 failed_urls.append(url)
-            return None
+                return None
 
     async def process_all_images():
         """處理所有圖片下載的主異步函數"""
-        connector = aiohttp.TCPConnector(limit=max_concurrent, force_close=True)
-        timeout = aiohttp.ClientTimeout(total=60)
-        async with aiohttp.ClientSession(connector=connector, 
-                                       timeout=timeout,
-                                       trust_env=True) as session:
-            tasks = []
-            for idx, global_id in enumerate(myDict["globalIds"], start=1):
-                image_urls = myDict["imagesByGlobalId"].get(global_id, [])
-                for img_idx, url in enumerate(image_urls, start=1):
-                    filename = os.path.join(images_dir, f"{global_id}_{img_idx}.png")
-                    task = download_single_image(session, url, filename, global_id, img_idx)
-                    tasks.append(task)
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            successful_downloads = [r for r in results if isinstance(r, str)]
-            failed_downloads = len(results) - len(successful_downloads)
-            
-            if verbose:
-                logger.info("\n" + "="*50)
-                logger.info("[COMPLETE] 圖片下載任務處理完成！")
-                # logger.info(f"-> 成功下載: {len(successful_downloads)} 個文件")
-                # logger.info(f"-> 失敗下載: {failed_downloads} 個文件")
-                #logger.info(f"-> 總計處理: {len(successful_downloads)}/{len(results)} 個文件")
-                if failed_urls:
-                    # logger.info("\n失敗的URL列表:")
-                    for url in failed_urls:
-                        # logger.info(f"- {url}")
-                        pass
-                logger.info("="*50 + "\n")
+        tasks = []
+        for idx, global_id in enumerate(myDict["globalIds"], start=1):
+            image_urls = myDict["imagesByGlobalId"].get(global_id, [])
+            for img_idx, url in enumerate(image_urls, start=1):
+                filename = os.path.join(images_dir, f"{global_id}_{img_idx}.png")
+                task = download_single_image(url, filename, global_id, img_idx)
+                tasks.append(task)
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        successful_downloads = [r for r in results if isinstance(r, str)]
+        failed_downloads = len(results) - len(successful_downloads)
+        
+        if verbose:
+            logger.info("\n" + "="*50)
+            logger.info("[COMPLETE] 圖片下載任務處理完成！")
+            # logger.info(f"-> 成功下載: {len(successful_downloads)} 個文件")
+            # logger.info(f"-> 失敗下載: {failed_downloads} 個文件")
+            #logger.info(f"-> 總計處理: {len(successful_downloads)}/{len(results)} 個文件")
+            if failed_urls:
+                # logger.info("\n失敗的URL列表:")
+                for url in failed_urls:
+                    # logger.info(f"- {url}")
+                    pass
+            logger.info("="*50 + "\n")
 
     await process_all_images()
     return success_files
@@ -239,6 +184,10 @@ def validate_and_convert_image(img_path: str, target_dir: str) -> Optional[str]:
         output_path = os.path.join(target_dir, f"converted_{filename}")
         
         with Image.open(img_path) as img:
+            # 不帶 EXIF 的 RGB JPEG(如 thumbnail 模式渲染的PDF頁面)可直接用於Word,不再重新編碼
+            if img.format == 'JPEG' and img.mode == 'RGB' and not img.getexif():
+                return link_or_copy(img_path, output_path)
+
             if img.mode in ['RGBA', 'LA']:
                 background = Image.new('RGB', img.size, (255, 255, 255))
                 if img.mode == 'RGBA':
@@ -0,0 +1,197 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Iterable, Optional
+from dotenv import load_dotenv
+from cache_utils import ARTIFACT_STORE_DIR
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+JANITOR_INTERVAL_SECONDS = int(os.getenv("JANITOR_INTERVAL_SECONDS", "600"))  # 清理間隔(秒)
+JANITOR_MAX_AGE_HOURS = float(os.getenv("JANITOR_MAX_AGE_HOURS", "1"))  # 文件保留時間(小時)
+DATA_DISK_QUOTA_MB = int(os.getenv("DATA_DISK_QUOTA_MB", "2048"))  # ./data 下受管理文件的磁盤配額(MB)
+ARTIFACT_MAX_AGE_HOURS = float(os.getenv("ARTIFACT_MAX_AGE_HOURS", "168"))  # 按內容尋址的 PDF 及派生圖片在最後一次使用後的保留時間(小時)
+
+# 受管理的目錄及其對應的文件類型
+DEFAULT_JANITOR_RULES = [
+    {"path": "data", "patterns": [".docx"]},
+    {"path": "data/images", "patterns": [".jpg", ".png"]},
+    {"path": "data/converted_images", "patterns": [".jpg", ".png"]},
+    {"path": "data/pdf_files", "patterns": [".pdf"]},
+    {"path": "data/pdf_files_from_fsis_fsa", "patterns": [".pdf"]},
+    {"path": "data/pdf_images_ocr", "patterns": [".jpg", ".png"]},
+    # 按內容尋址的存儲 : 使用時會更新文件時間,保留時間按最後一次使用計算
+    {"path": os.path.join(ARTIFACT_STORE_DIR, "pdf"), "patterns": [".pdf"], "max_age_hours": ARTIFACT_MAX_AGE_HOURS},
+    {"path": os.path.join(ARTIFACT_STORE_DIR, "derived"), "patterns": [".jpg", ".png", ".pages"], "max_age_hours": ARTIFACT_MAX_AGE_HOURS},
+]
+
+
+class FilePinRegistry:
+    """
+    記錄正在進行中的任務所使用的文件標識(通常是 globalId),文件名中包含任一被固定的標識時,清理任務不會刪除該文件
+
+    以引用計數實現,同一標識可被多個任務同時固定
+    """
+
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def pin(self, tokens: Iterable[str]):
+        with self._lock:
+            for token in tokens:
+                if token:
+                    self._counts[token] = self._counts.get(token, 0) + 1
+
+    def unpin(self, tokens: Iterable[str]):
+        with self._lock:
+            for token in tokens:
+                if token in self._counts:
+                    self._counts[token] -= 1
+                    if self._counts[token] <= 0:
+                        del self._counts[token]
+
+    @contextmanager
+    def pinned(self, tokens: Iterable[str]):
+        """在 with 代碼塊內固定給定的標識"""
+        tokens = [token for token in tokens if token]
+        self.pin(tokens)
+        try:
+            yield
+        finally:
+            self.unpin(tokens)
+
+    def snapshot(self) -> List[str]:
+        with self._lock:
+            return list(self._counts)
+
+
+file_pins = FilePinRegistry()
+
+
+class DataJanitor:
+    """
+    後台定期清理 ./data 下的臨時文件
+
+    - 每個目錄只做一次 `os.scandir` 遍歷,按創建時間刪除超過保留時間的文件
+    - 受管理文件的總大小超過配額時,按最近訪問時間(LRU)繼續淘汰
+    - 文件名中包含被 `file_pins` 固定的標識時一律跳過
+    - 硬鏈接(如 data/images 與 data/artifacts 中的同一份文件)按 (st_dev, st_ino) 只計算一次大小;
+      配額淘汰以 inode 為單位,任一鏈接被固定時整個 inode 都保留,淘汰時刪除其全部鏈接才能真正釋放空間
+    """
+
+    def __init__(self, rules: Optional[List[Dict]] = None, interval: int = JANITOR_INTERVAL_SECONDS,
+                 max_age_hours: float = JANITOR_MAX_AGE_HOURS, quota_mb: int = DATA_DISK_QUOTA_MB,
+                 pins: FilePinRegistry = file_pins):
+        self.rules = rules or DEFAULT_JANITOR_RULES
+        self.interval = interval
+        self.max_age_seconds = max_age_hours * 3600
+        self.quota_bytes = quota_mb * 1024 * 1024
+        self.pins = pins
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """啟動後台清理任務,需在事件循環內調用"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"文件清理任務已啟動,間隔: {self.interval} 秒")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                # 文件系統操作放到線程中執行,避免阻塞事件循環
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"清理舊文件時發生錯誤: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        執行一次清理
+
+        Returns:
+            dict: 本次清理的統計信息(刪除的過期文件數、配額淘汰文件數、釋放的字節數)
+        """
+        pinned_tokens = self.pins.snapshot()
+        now = time.time()
+        stats = {"expired": 0, "evicted": 0, "freed_bytes": 0}
+        # 按 inode 聚合的存活文件 : (st_dev, st_ino) -> {"last_used", "size", "nlink", "paths", "pinned"}
+        inodes: Dict[tuple, Dict] = {}
+
+        for rule in self.rules:
+            base_path = rule["path"]
+            patterns = tuple(rule["patterns"])
+            # 規則可單獨指定保留時間,未指定時使用默認值
+            max_age_seconds = rule["max_age_hours"] * 3600 if "max_age_hours" in rule else self.max_age_seconds
+            expire_before = now - max_age_seconds
+            if not os.path.isdir(base_path):
+                continue
+
+            with os.scandir(base_path) as entries:
+                for entry in entries:
+                    if not entry.is_file(follow_symlinks=False) or not entry.name.endswith(patterns):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+
+                    pinned = any(token in entry.name for token in pinned_tokens)
+                    if not pinned and st.st_ctime < expire_before:
+                        if self._remove(entry.path):
+                            stats["expired"] += 1
+                            # 只有最後一個鏈接被刪除時才真正釋放空間
+                            if st.st_nlink <= 1:
+                                stats["freed_bytes"] += st.st_size
+                        continue
+
+                    inode = inodes.setdefault((st.st_dev, st.st_ino), {
+                        "last_used": 0, "size": st.st_size, "nlink": st.st_nlink, "paths": [], "pinned": False})
+                    inode["last_used"] = max(inode["last_used"], st.st_atime, st.st_mtime)
+                    inode["paths"].append(entry.path)
+                    inode["pinned"] = inode["pinned"] or pinned
+
+        total_bytes = sum(inode["size"] for inode in inodes.values())
+
+        # 超過配額時按 LRU 淘汰未固定的 inode : 存在受管理目錄之外的鏈接時刪除也無法釋放空間,跳過
+        if total_bytes > self.quota_bytes:
+            candidates = sorted(
+                (inode for inode in inodes.values() if not inode["pinned"] and inode["nlink"] <= len(inode["paths"])),
+                key=lambda inode: inode["last_used"])
+            for inode in candidates:
+                if total_bytes <= self.quota_bytes:
+                    break
+                removed = [path for path in inode["paths"] if self._remove(path)]
+                if removed:
+                    stats["evicted"] += len(removed)
+                    if len(removed) == len(inode["paths"]):
+                        total_bytes -= inode["size"]
+                        stats["freed_bytes"] += inode["size"]
+
+        if stats["expired"] or stats["evicted"]:
+            logger.info(f"清理舊文件完成: 過期 {stats['expired']} 個, 配額淘汰 {stats['evicted']} 個, 釋放 {stats['freed_bytes'] / 1024 / 1024:.1f} MB")
+        return stats
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            logger.debug(f"已刪除舊文件: {path}")
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"刪除文件失敗 {path}: {str(e)}")
+            return False
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, List
+from dotenv import load_dotenv
+
+from generate_word_report import createReport
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+REPORT_WORKER_COUNT = int(os.getenv("REPORT_WORKER_COUNT", "2"))  # 後台並發生成報告的 worker 數量
+REPORT_JOB_QUEUE_SIZE = int(os.getenv("REPORT_JOB_QUEUE_SIZE", "100"))  # 等待隊列的最大長度
+REPORT_JOB_TTL_SECONDS = int(os.getenv("REPORT_JOB_TTL_SECONDS", "3600"))  # 已結束任務的狀態保留時間
+REPORT_CACHE_TTL_SECONDS = int(os.getenv("REPORT_CACHE_TTL_SECONDS", "1800"))  # 已生成報告的緩存時間
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "128"))  # 報告緩存的最大條目數
+
+TEMPLATE_PATH = "report_template.docx"
+REPORT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def build_report_key(data: Dict[str, Any], userId: str, template_path: str = TEMPLATE_PATH) -> str:
+    """
+    根據請求內容生成報告的規範化哈希鍵 : 用戶ID、按請求順序排列的 globalIds(報告按此順序編號)、各 globalId 的圖片URL以及模板文件的修改時間
+
+    Args:
+        data (dict): `/foodrecall_report` 接收到的原始請求數據
+        userId (str): 用戶ID,報告文件名中包含用戶ID,不同用戶不共享報告
+        template_path (str): Word模板文件路徑,模板變更後舊的緩存自動失效
+
+    Returns:
+        str: SHA-256 十六進制字符串
+    """
+    global_ids = list(data.get("globalIds", []))
+    images_by_global_id = data.get("imagesByGlobalId", {}) or {}
+    try:
+        template_mtime = os.path.getmtime(template_path)
+    except OSError:
+        template_mtime = 0
+
+    canonical = {
+        "userId": userId,
+        "globalIds": global_ids,
+        "imagesByGlobalId": {global_id: list(images_by_global_id.get(global_id, [])) for global_id in global_ids},
+        "templateMtime": template_mtime
+    }
+    payload = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReportSingleFlight:
+    """
+    `createReport` 前的單飛(single-flight)合併層與結果緩存
+
+    - 同一時間內相同請求(鍵相同)只執行一次報告生成流程,其餘請求等待並共享結果
+    - 生成完成的報告按 TTL 緩存在有界的 LRU 中,重複請求直接返回已存在的 report_*.docx
+    """
+
+    def __init__(self, ttl: int = REPORT_CACHE_TTL_SECONDS, max_entries: int = REPORT_CACHE_MAX_ENTRIES, data_dir: str = REPORT_DATA_DIR):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.data_dir = data_dir
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (filename, created_at, mtime_ns)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._callbacks: Dict[str, List[Callable]] = {}
+
+    def _file_mtime_ns(self, filename: str) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self.data_dir, filename)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _get_cached(self, key: str) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        filename, created_at, mtime_ns = entry
+        # 過期、文件已被清理或已被覆蓋(同一用戶同一分鐘內生成的其他報告使用相同文件名),均視為未命中
+        if time.time() - created_at > self.ttl or self._file_mtime_ns(filename) != mtime_ns:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return filename
+
+    def _put_cached(self, key: str, filename: str):
+        self._cache[key] = (filename, time.time(), self._file_mtime_ns(filename))
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _broadcast_progress(self, key: str, stage: str, progress: int):
+        for callback in list(self._callbacks.get(key, [])):
+            try:
+                callback(stage, progress)
+            except Exception as e:
+                logger.warning(f"回報進度時出錯: {str(e)}")
+
+    async def _run(self, key: str, data: Dict[str, Any], userId: str) -> str:
+        try:
+            # 以報告鍵的前綴作為文件名中的唯一標識 : 不同請求(即使同一用戶同一分鐘)寫入不同文件
+            filename = await createReport(
+                data, userId=userId, run_id=key[:12],
+                progress_callback=lambda stage, progress: self._broadcast_progress(key, stage, progress))
+            self._put_cached(key, filename)
+            return filename
+        finally:
+            self._inflight.pop(key, None)
+            self._callbacks.pop(key, None)
+
+    async def run(self, data: Dict[str, Any], userId: str, progress_callback: Optional[Callable] = None) -> str:
+        """
+        生成報告(或復用已有結果)
+
+        Args:
+            data (dict): `/foodrecall_report` 接收到的原始請求數據
+            userId (str): 用戶ID
+            progress_callback (callable): 可選,用於回報流程階段與進度的回調函數
+
+        Returns:
+            str: 生成的Word報告文件名
+        """
+        key = build_report_key(data, userId)
+
+        filename = self._get_cached(key)
+        if filename:
+            logger.info(f"命中報告緩存,直接返回: {filename}")
+            return filename
+
+        if progress_callback is not None:
+            self._callbacks.setdefault(key, []).append(progress_callback)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, data, userId))
+            self._inflight[key] = task
+        else:
+            logger.info(f"相同的報告請求正在生成中,合併等待: {key[:12]}")
+
+        # shield : 某個等待者被取消時,不影響共享的報告生成流程
+        return await asyncio.shield(task)
+
+
+report_single_flight = ReportSingleFlight()
+
+
+class ReportJobManager:
+    """
+    報告生成任務管理器 : 以有界的後台 worker 池執行報告生成(經由單飛合併層),並記錄每個任務的階段、進度與最終文件名
+
+    worker 數量與 HTTP 連接數無關,可以獨立地按 Dify / 上游接口的承受能力調整並發
+    """
+
+    def __init__(self, worker_count: int = REPORT_WORKER_COUNT, max_queue_size: int = REPORT_JOB_QUEUE_SIZE, job_ttl: int = REPORT_JOB_TTL_SECONDS):
+        self.worker_count = worker_count
+        self.max_queue_size = max_queue_size
+        self.job_ttl = job_ttl
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+
+    async def start(self):
+        """啟動後台 worker,需在事件循環內調用(例如 FastAPI 的 startup 事件)"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        logger.info(f"報告任務 worker 已啟動,數量: {self.worker_count}")
+
+    async def stop(self):
+        """停止所有後台 worker"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("報告任務 worker 已停止")
+
+    def submit(self, data: Dict[str, Any], userId: str) -> Dict[str, Any]:
+        """
+        提交一個報告生成任務,立即返回任務信息
+
+        Args:
+            data (dict): `/foodrecall_report` 接收到的原始請求數據
+            userId (str): 用戶ID
+
+        Returns:
+            dict: 新建任務的狀態字典
+
+        Raises:
+            asyncio.QueueFull: 等待隊列已滿
+        """
+        if self._queue is None:
+            raise RuntimeError("ReportJobManager 尚未啟動")
+
+        self._prune_finished_jobs()
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "user_id": userId,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0,
+            "filename": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        self._queue.put_nowait((job_id, data, userId))
+        self.jobs[job_id] = job
+        logger.info(f"報告任務已加入隊列: {job_id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """根據任務ID獲取任務狀態,不存在則返回None"""
+        return self.jobs.get(job_id)
+
+    def _update(self, job_id: str, **fields):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        job["updated_at"] = time.time()
+
+    def _prune_finished_jobs(self):
+        """清理超過保留時間的已結束任務"""
+        expire_before = time.time() - self.job_ttl
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["status"] in ("succeeded", "failed") and job["updated_at"] < expire_before
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def _worker(self, worker_idx: int):
+        while True:
+            job_id, data, userId = await self._queue.get()
+            try:
+                self._update(job_id, status="running", stage="started")
+
+                def progress_callback(stage, progress, _job_id=job_id):
+                    self._update(_job_id, stage=stage, progress=progress)
+
+                filename = await report_single_flight.run(data, userId=userId, progress_callback=progress_callback)
+                self._update(job_id, status="succeeded", stage="done", progress=100, filename=filename)
+                logger.info(f"[worker {worker_idx}] 報告任務完成: {job_id} -> {filename}")
+            except asyncio.CancelledError:
+                self._update(job_id, status="failed", error="任務被取消")
+                raise
+            except Exception as e:
+                logger.error(f"[worker {worker_idx}] 報告任務失敗: {job_id} - {str(e)}")
+                self._update(job_id, status="failed", error=str(e))
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,32 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List
+
+
+class KeyedLocks:
+    """
+    按鍵分配的 asyncio.Lock : 同一個鍵的協程互斥執行,不同鍵互不影響
+
+    以引用計數記錄每個鍵的持有者和等待者,最後一個釋放時移除該鍵,長時間運行的服務中鎖的數量不會無限增長
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, List] = {}  # key -> [lock, 持有及等待的協程數]
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        """在 async with 代碼塊內持有 key 對應的鎖"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
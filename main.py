@@ -1,5 +1,5 @@
 from fastapi import FastAPI, UploadFile, File, Request, HTTPException
-from fastapi.responses import FileResponse  # 將文件作爲HTTP請求返回給客戶端(即Word文檔返回)
+from fastapi.responses import FileResponse, JSONResponse  # 將文件作爲HTTP請求返回給客戶端(即Word文檔返回)
 from typing import List, Optional
 import os  
 import json  
@@ -8,13 +8,38 @@ from docx.shared import Mm  # 設置Word文檔的相關尺寸
 from datetime import datetime
 import time
 import uvicorn
-from generate_word_report import createReport
+import asyncio
+from job_utils import ReportJobManager, report_single_flight
+from janitor_utils import DataJanitor
+from http_utils import init_http_fetcher, close_http_fetcher
+from api_utils import init_dify_client, close_dify_client
+from pdf_image_extractor import shutdown_render_pool
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI()  # 創建FastAPI應用實例
+job_manager = ReportJobManager()  # 後台報告生成任務管理器
+data_janitor = DataJanitor()  # 後台定期清理 ./data 下的舊文件
+
+
+@app.on_event("startup")
+async def startup_event():
+    os.makedirs("data", exist_ok=True)
+    await init_http_fetcher()
+    await init_dify_client()
+    await job_manager.start()
+    data_janitor.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await data_janitor.stop()
+    await job_manager.stop()
+    await close_http_fetcher()
+    await close_dify_client()
+    shutdown_render_pool()
 
 
 # 添加健康檢查端點
@@ -23,30 +48,44 @@ async def health_check():
     return {"status": "healthy"}
 
 @app.post("/foodrecall_report")
-async def foodrecall_report(request: Request):
+async def foodrecall_report(request: Request, mode: str = "sync"):
+    """
+    生成食品回收報告
+
+    mode=sync(默認) : 在請求內等待報告生成完成,返回文件名
+    mode=job : 立即返回任務ID,由後台 worker 生成報告,通過 `GET /jobs/{job_id}` 查詢進度
+    """
     data = await request.json()
     user_id = data.get("userId","admin")
-    # 刪除歷史文件
-    files = os.listdir(r"./data")
-    filelink = ['./data/'+f for f in files if f.endswith(('.docx'))]  # 得到data目錄下的所有.docx文件的路徑
-    timestamp = time.time() - 3600
-    n = len(filelink)
-    if n > 0:
-        for i in range(len(filelink)):
-            if os.path.getctime(filelink[i]) < timestamp:
-                os.remove(filelink[i])  # datatime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d-%H-%M-%S-%f') 
-            else:
-                pass
-    else:
-        pass
+
+    if mode == "job":
+        try:
+            job = job_manager.submit(data, userId=user_id)
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="報告任務隊列已滿,請稍後重試")
+        return JSONResponse(
+            status_code=202,
+            content={
+                "job_id": job["job_id"],
+                "status": job["status"],
+                "status_url": f"/jobs/{job['job_id']}"
+            })
 
     try:
-        filename = await createReport(data, userId=user_id)
+        filename = await report_single_flight.run(data, userId=user_id)
         return filename
     except Exception as e:
         logger.error(f"生成報告時發生錯誤: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# 查詢報告任務狀態
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任務 {job_id} 不存在")
+    return job
+
 # 下載文件
 @app.get("/download_file/{filename}")
 async def download_file(filename: str):
@@ -0,0 +1,233 @@
+import re
+import logging
+from typing import Dict, List, Any
+
+from data_utils import standardize_source
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 合併層 : 每一層都是以 globalId 為鍵的 {globalId: {字段: 值}} 索引
+REGEX = "regex"  # extractor_utils 中各來源提取器的本地提取結果
+PDF2CONTENT = "pdf2content"  # Dify PDF2Content 工作流的結果 (CDPH / HK)
+FOODSAFETY = "foodsafety"  # Dify foodsafety 工作流的結果
+BLANK = "blank"  # 固定為 "--"
+
+# 最終字段的優先級 : 按順序查找各合併層,第一個包含該字段的層勝出;都沒有時 title 使用原始標題,其餘字段為 "--"
+DEFAULT_PRECEDENCE = {
+    "title": (REGEX,),
+    "distribution": (REGEX, FOODSAFETY),
+    "recycling_reason": (REGEX, FOODSAFETY),
+}
+
+# 各來源(標準化後的名稱)對默認優先級的覆蓋,未列出的字段沿用 DEFAULT_PRECEDENCE
+SOURCE_PRECEDENCE = {
+    "US CDPH": {
+        "title": (PDF2CONTENT,),
+        "distribution": (PDF2CONTENT, FOODSAFETY),
+    },
+    "香港食物安全中心": {
+        "distribution": (PDF2CONTENT, FOODSAFETY),
+    },
+    "EFSA": {
+        "distribution": (BLANK,),
+    },
+    "WHO": {
+        "distribution": (BLANK,),
+    },
+}
+
+MERGED_FIELDS = ("title", "distribution", "recycling_reason")
+
+# createReport 中 title 的拼接不依賴 is_or_not_reason 的來源 (與 createReport 中 title 的拼接規則保持一致)
+IS_OR_NOT_INDEPENDENT_SOURCES = {
+    "US CDPH", "香港食物安全中心", "US FSIS", "UK FSA", "FSS", "Government of Canada",
+    "US FDA", "RASFF", "EFSA", "WHO",
+}
+# recycling_reason 不為 "--" 時直接將 title 與 recycling_reason 拼接的來源
+REASON_APPENDED_SOURCES = {"FSANZ", "NZ MPI", "Rappel Conso"}
+
+
+def index_dict_list(dict_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """將 [{globalId: value}, ...] 形式的列表合併為一個 {globalId: value} 查找字典"""
+    lookup = {}
+    for d in dict_list or []:
+        if isinstance(d, dict):
+            lookup.update(d)
+    return lookup
+
+
+def index_by_global_id(dict_list: List[Dict[str, Any]], value_key: str) -> Dict[str, Any]:
+    """將 [{"global_id"/"globalId": ..., value_key: ...}, ...] 形式的列表轉換為 {globalId: value} 查找字典"""
+    lookup = {}
+    for d in dict_list or []:
+        if not isinstance(d, dict) or value_key not in d:
+            continue
+        global_id = d.get("global_id") or d.get("globalId")
+        if global_id:
+            lookup[global_id] = d[value_key]
+    return lookup
+
+
+def clean_foodsafety_distribution(value: str) -> str:
+    """將地點之間的分隔符 '", "' 替換為換行符,並清理兩端的空格和雙引號;包含 "全國" 時統一為 "National" """
+    if value == "--":
+        return value
+    cleaned = value.replace('", "', '\n').strip().strip('"')
+    if "全國" in cleaned:
+        return "National"
+    return cleaned
+
+
+def clean_foodsafety_recycling_reason(value: str) -> str:
+    if value == "--":
+        return value
+    return value.replace('", "', ',').strip()
+
+
+def clean_cdph_distribution(value: str, url: str) -> str:
+    """清理換行符和多餘空格;包含 "Retail" 時附加零售商列表 URL"""
+    cleaned = re.sub(r'\s+', ' ', value.replace('\n', ' ')).strip()
+    if "Retail" in cleaned:
+        try:
+            temp_url = re.sub(r'/[A-Za-z]+20\d{2}/', '/ProductandRetailDistributionLists/', url)
+            retailer_list_url = re.sub(r'n\.pdf$', 'd.pdf', temp_url)
+            return f"{cleaned},RETAIL_LINK:{retailer_list_url}"
+        except Exception as e:
+            logger.error(f"Failed to generate retailer URL for {url}: {e}")
+    return cleaned
+
+
+def build_foodsafety_layer(distribution_dict_list: List[Dict], recycling_reason_dict_list: List[Dict]) -> Dict[str, Dict[str, str]]:
+    """
+    根據 foodsafety 工作流的輸出構建合併層
+
+    Args:
+        distribution_dict_list (list): 輸出中的 id_distribution_dict_list
+        recycling_reason_dict_list (list): 輸出中的 id_recyclingReason_dict_list
+
+    Returns:
+        dict: {globalId: {"distribution"/"recycling_reason": value}}
+    """
+    layer: Dict[str, Dict[str, str]] = {}
+    for global_id, value in index_by_global_id(distribution_dict_list, "distribution").items():
+        layer.setdefault(global_id, {})["distribution"] = clean_foodsafety_distribution(value)
+    for global_id, value in index_by_global_id(recycling_reason_dict_list, "recycling_reason").items():
+        layer.setdefault(global_id, {})["recycling_reason"] = clean_foodsafety_recycling_reason(value)
+    return layer
+
+
+def build_pdf2content_layer(cdph_title_dict_list: List[Dict], cdph_distribution_dict_list: List[Dict],
+                            hk_distribution_dict_list: List[Dict], url_dict: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+    """
+    根據 PDF2Content 工作流的輸出構建合併層,空值不會覆蓋其他層
+
+    Args:
+        cdph_title_dict_list (list): CDPH 的 [{globalId: title}]
+        cdph_distribution_dict_list (list): CDPH 的 [{globalId: distribution}]
+        hk_distribution_dict_list (list): HK 的 [{globalId: distribution}]
+        url_dict (dict): {globalId: url},用於生成 CDPH 零售商列表鏈接以及判斷 HK 條目是否為 PDF
+
+    Returns:
+        dict: {globalId: {"title"/"distribution": value}}
+    """
+    layer: Dict[str, Dict[str, str]] = {}
+    for global_id, title in index_dict_list(cdph_title_dict_list).items():
+        if title:
+            layer.setdefault(global_id, {})["title"] = title
+    for global_id, distribution in index_dict_list(cdph_distribution_dict_list).items():
+        if distribution:
+            layer.setdefault(global_id, {})["distribution"] = clean_cdph_distribution(distribution, url_dict.get(global_id, ""))
+    for global_id, distribution in index_dict_list(hk_distribution_dict_list).items():
+        if distribution and url_dict.get(global_id, "").endswith(".pdf"):
+            layer.setdefault(global_id, {})["distribution"] = distribution.replace('", "', '\n').strip().strip('"')
+    return layer
+
+
+def resolve_precedence(source: str) -> Dict[str, tuple]:
+    """返回某來源各字段的合併層優先級"""
+    precedence = dict(DEFAULT_PRECEDENCE)
+    precedence.update(SOURCE_PRECEDENCE.get(source, {}))
+    return precedence
+
+
+def resolved_locally(source: str, record: Dict[str, str]) -> bool:
+    """
+    判斷某條目的 distribution 和 recycling_reason 是否都已由本地(regex 提取或固定值)確定,
+    即按優先級在 FOODSAFETY 層之前就能取到值
+
+    Args:
+        source (str): 標準化後的來源名稱
+        record (dict): 該條目在 REGEX 層中的記錄,沒有時為空字典
+    """
+    precedence = resolve_precedence(source)
+    for field in ("distribution", "recycling_reason"):
+        for layer_name in precedence.get(field, ()):
+            if layer_name == BLANK or (layer_name == REGEX and field in record):
+                break
+            if layer_name in (FOODSAFETY, PDF2CONTENT):
+                return False
+    return True
+
+
+def title_needs_is_or_not(source: str, record: Dict[str, str]) -> bool:
+    """判斷生成報告 title 時是否需要 is_or_not_reason(title 是否已包含回收原因)"""
+    if source in IS_OR_NOT_INDEPENDENT_SOURCES:
+        return False
+    if record.get("recycling_reason", "--") == "--":
+        return False
+    if source in REASON_APPENDED_SOURCES:
+        return False
+    if source == "NSW Food Authority" and record.get("distribution", "--") != "--":
+        return False
+    return True
+
+
+def merge_final_records(myDict: Dict[str, Any], layers: Dict[str, Dict[str, Dict[str, str]]],
+                        is_or_not_dict_list: List[Dict]) -> List[Dict[str, Any]]:
+    """
+    單次遍歷生成最終的 myDictFinalList : 按 SOURCE_PRECEDENCE / DEFAULT_PRECEDENCE 從各合併層中為每個條目選取字段
+
+    Args:
+        myDict (dict): `create_product_dict()` 返回的自定義字典
+        layers (dict): {合併層名稱: {globalId: {字段: 值}}}
+        is_or_not_dict_list (list): foodsafety 工作流輸出中的 id_isOrNot_dict_list
+
+    Returns:
+        list: 最終的 myDictFinalList,順序與 myDict["globalIds"] 一致
+    """
+    is_or_not_lookup = index_by_global_id(is_or_not_dict_list, "is_or_not_reason")
+    precedence_cache: Dict[str, Dict[str, tuple]] = {}
+
+    final_records = []
+    for idx, global_id in enumerate(myDict["globalIds"]):
+        source = standardize_source(myDict["fromDict"].get(global_id, ""))
+        precedence = precedence_cache.get(source)
+        if precedence is None:
+            precedence = precedence_cache[source] = resolve_precedence(source)
+
+        values = {"title": myDict["titleDict"].get(global_id, ""), "distribution": "--", "recycling_reason": "--"}
+        for field in MERGED_FIELDS:
+            for layer_name in precedence.get(field, ()):
+                if layer_name == BLANK:
+                    values[field] = "--"
+                    break
+                record = layers.get(layer_name, {}).get(global_id)
+                if record and field in record:
+                    values[field] = record[field]
+                    break
+
+        final_records.append({
+            "num": idx + 1,
+            "title": values["title"],
+            "url": myDict["urlDict"].get(global_id, ""),
+            "source": source,
+            "distribution": values["distribution"],
+            "recycling_reason": values["recycling_reason"],
+            "products": [],
+            "global_id": global_id,
+            "is_or_not_reason": is_or_not_lookup.get(global_id, "未知"),
+        })
+
+    return final_records
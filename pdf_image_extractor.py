@@ -13,15 +13,127 @@ from tqdm import tqdm
 import ssl
 import urllib3
 import logging
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+load_dotenv()
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))  # 並行渲染PDF頁面的進程數,設為1時在線程中逐頁渲染
+PDF_RENDER_MIN_PAGES = int(os.getenv("PDF_RENDER_MIN_PAGES", "2"))  # 頁數不少於此值時才分發到進程池,單頁PDF不值得跨進程
+PDF_RENDER_MODE = os.getenv("PDF_RENDER_MODE", "thumbnail")  # FSIS/FSA頁面的渲染模式 : thumbnail(按報告顯示尺寸直接輸出JPEG) / full(2倍縮放的PNG)
+PDF_THUMBNAIL_BOX_MM = float(os.getenv("PDF_THUMBNAIL_BOX_MM", "40"))  # 報告中圖片的最大顯示邊長(毫米),與 _create_report 中的 MAX_WIDTH/MAX_HEIGHT 一致
+PDF_THUMBNAIL_DPI = int(os.getenv("PDF_THUMBNAIL_DPI", "200"))  # thumbnail 模式下按此DPI計算輸出像素
+PDF_THUMBNAIL_JPEG_QUALITY = int(os.getenv("PDF_THUMBNAIL_JPEG_QUALITY", "85"))  # thumbnail 模式輸出JPEG的質量
+
+FULL_RENDER_ZOOM = 2  # full 模式的縮放倍數
+
+_render_pool = None
+
+
+def get_render_pool():
+    """返回共享的頁面渲染進程池(首次使用時創建),未啟用並行渲染時返回None"""
+    global _render_pool
+    if PDF_RENDER_WORKERS <= 1:
+        return None
+    if _render_pool is None:
+        # 使用 spawn 啟動子進程 : 避免 fork 時複製事件循環、線程鎖和數據庫連接等狀態
+        _render_pool = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS,
+                                           mp_context=multiprocessing.get_context("spawn"))
+    return _render_pool
+
+
+def shutdown_render_pool():
+    """關閉頁面渲染進程池(應用關閉時調用)"""
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+def page_count(pdf_path: str) -> int:
+    """返回PDF的總頁數"""
+    doc = fitz.open(pdf_path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def render_ext(render_mode: str) -> str:
+    """返回渲染模式對應的圖片擴展名"""
+    return "jpg" if render_mode == "thumbnail" else "png"
+
+
+def _page_zoom(page, render_mode: str) -> float:
+    """
+    計算頁面的縮放倍數 : full 模式固定為 FULL_RENDER_ZOOM;
+    thumbnail 模式使頁面長邊正好填滿報告中的顯示框(PDF_THUMBNAIL_BOX_MM 在 PDF_THUMBNAIL_DPI 下的像素數),且不超過 full 模式
+    """
+    if render_mode != "thumbnail":
+        return FULL_RENDER_ZOOM
+    box_px = PDF_THUMBNAIL_BOX_MM / 25.4 * PDF_THUMBNAIL_DPI
+    # 頁面尺寸以點(1/72英寸)為單位,縮放倍數為1時每點對應1像素
+    long_side = max(page.rect.width, page.rect.height)
+    return min(FULL_RENDER_ZOOM, box_px / long_side) if long_side else FULL_RENDER_ZOOM
+
+
+def _save_page(doc, page_num: int, output_dir: str, pdf_name: str, render_mode: str) -> str:
+    """渲染單頁並保存為 {pdf_name}_{頁碼+1}.png/.jpg,返回圖片路徑"""
+    page = doc.load_page(page_num)
+    zoom = _page_zoom(page, render_mode)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    ext = render_ext(render_mode)
+    img_path = os.path.join(output_dir, f"{pdf_name}_{page_num + 1}.{ext}")
+    # 先寫入臨時文件再重命名,避免其他請求讀到未寫完的圖片
+    temp_path = f"{img_path}.{os.getpid()}.part.{ext}"
+    if ext == "jpg":
+        pix.save(temp_path, "jpeg", jpg_quality=PDF_THUMBNAIL_JPEG_QUALITY)
+    else:
+        pix.save(temp_path)
+    os.replace(temp_path, img_path)
+    return img_path
+
+
+def _render_pages(pdf_path: str, page_numbers: List[int], output_dir: str, render_mode: str = "full") -> List[tuple]:
+    """
+    在工作進程中渲染PDF的部分頁面 : 每個進程獨立打開文檔(fitz.Document 不能跨進程共享)
+
+    Args:
+        pdf_path (str): PDF文件路徑
+        page_numbers (List[int]): 需要渲染的頁碼(從0開始)
+        output_dir (str): 圖片保存目錄,文件名為 {pdf_name}_{頁碼+1}.png(thumbnail 模式為 .jpg)
+        render_mode (str): 渲染模式,full 或 thumbnail
+
+    Returns:
+        List[tuple]: 成功渲染的 (頁碼, 圖片路徑) 列表
+    """
+    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    rendered = []
+    doc = fitz.open(pdf_path)
+    try:
+        for page_num in page_numbers:
+            try:
+                rendered.append((page_num, _save_page(doc, page_num, output_dir, pdf_name, render_mode)))
+            except Exception as page_error:
+                logger.error(f"處理第{page_num+1}頁時出錯: {page_error}")
+    finally:
+        doc.close()
+    return rendered
+
 class PDFImageExtractor:
-    def __init__(self, output_dir="extracted_images", proxy=None):
+    def __init__(self, output_dir="extracted_images", proxy=None, render_mode="full"):
+        if render_mode not in ("full", "thumbnail"):
+            raise ValueError(f"未知的渲染模式: {render_mode}")
         self.output_dir = output_dir
         self.proxy = proxy
+        self.render_mode = render_mode  # full : 2倍縮放的PNG;thumbnail : 按報告顯示尺寸輸出的JPEG
+        self.image_ext = render_ext(render_mode)
         os.makedirs(output_dir, exist_ok=True)
     
     def download_pdf(self, url: str, output_dir: str = None) -> str:
@@ -181,7 +293,7 @@ class PDFImageExtractor:
         return None
     
     def convert_pdf_to_images(self, pdf_path: str) -> List[str]:
-        """將PDF的每一頁轉換為PNG格式的圖片，使用倍數縮放以提供更高質量的圖片輸出
+        """將PDF的每一頁轉換為圖片 : full 模式使用倍數縮放輸出PNG以提供更高質量的圖片;thumbnail 模式按報告顯示尺寸直接輸出JPEG
 
         Args:
             pdf_path (str): PDF文件路徑
@@ -204,16 +316,7 @@ class PDFImageExtractor:
             
             for page_num in range(total_pages):
                 try:
-                    page = doc.load_page(page_num)
-                    # 使用3倍縮放以獲得更大更清晰的圖片
-                    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                    
-                    # 生成圖片文件名
-                    img_filename = f"{pdf_name}_{page_num + 1}.png"
-                    img_path = os.path.join(self.output_dir, img_filename)
-                    
-                    # 保存圖片
-                    pix.save(img_path)
+                    img_path = _save_page(doc, page_num, self.output_dir, pdf_name, self.render_mode)
                     converted_images.append(img_path)
                     
                 except Exception as page_error:
@@ -232,6 +335,65 @@ class PDFImageExtractor:
         except Exception as e:
             logger.error(f"PDF轉換失敗 {pdf_path}: {e}")
             return []
+
+    async def convert_pdf_to_images_async(self, pdf_path: str) -> List[str]:
+        """
+        convert_pdf_to_images 的並行版本 : 將頁面分成若干組分發到共享進程池,各工作進程獨立打開文檔渲染,
+        渲染不佔用事件循環且隨CPU核數擴展。頁數較少或未啟用進程池時,在線程中逐頁渲染
+
+        Args:
+            pdf_path (str): PDF文件路徑
+
+        Returns:
+            List[str]: 按頁碼排列的圖片文件路徑列表(出錯的頁面被跳過)
+        """
+        if not os.path.exists(pdf_path):
+            logger.warning(f"PDF文件不存在: {pdf_path}")
+            return []
+
+        try:
+            total_pages = await asyncio.to_thread(page_count, pdf_path)
+        except Exception as e:
+            logger.error(f"PDF轉換失敗 {pdf_path}: {e}")
+            return []
+
+        pool = get_render_pool()
+        if pool is None or total_pages < PDF_RENDER_MIN_PAGES:
+            return await asyncio.to_thread(self.convert_pdf_to_images, pdf_path)
+
+        logger.info(f"開始並行轉換PDF: {os.path.basename(pdf_path)}，總頁數: {total_pages}")
+        # 按頁碼交錯分組,每組由一個進程渲染,文檔在每個進程中只打開一次
+        groups = min(PDF_RENDER_WORKERS, total_pages)
+        loop = asyncio.get_running_loop()
+        tasks = [
+            loop.run_in_executor(pool, _render_pages, pdf_path, list(range(i, total_pages, groups)),
+                                 self.output_dir, self.render_mode)
+            for i in range(groups)
+        ]
+        try:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        except BrokenProcessPool:
+            results = [BrokenProcessPool()]
+
+        if any(isinstance(r, BrokenProcessPool) for r in results):
+            # 工作進程異常退出時進程池不可再用 : 重建進程池,本次在線程中逐頁渲染
+            logger.warning("頁面渲染進程池已損壞,改為在線程中渲染")
+            shutdown_render_pool()
+            return await asyncio.to_thread(self.convert_pdf_to_images, pdf_path)
+
+        rendered = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"渲染PDF頁面時出錯 {pdf_path}: {result}")
+                continue
+            rendered.extend(result)
+        converted_images = [path for _, path in sorted(rendered)]
+
+        if converted_images:
+            logger.info(f"PDF轉換完成，共生成 {len(converted_images)} 張圖片")
+        else:
+            logger.warning("PDF轉換失敗，未生成任何圖片")
+        return converted_images
     
     def extract_images_from_pdf(self, pdf_path: str) -> List[str]:
         """從PDF中提取所有圖片，支持進度顯示"""
@@ -1,24 +1,37 @@
 import os
 import time
-import random
 import logging
+import asyncio
 import fitz  # PyMuPDF
 from PIL import Image
-from curl_cffi import requests as cffi_requests
-from pdf_image_extractor import PDFImageExtractor
+from pdf_image_extractor import PDFImageExtractor, PDF_RENDER_MODE, render_ext, page_count
 from pdfminer.high_level import extract_text
 import re
-import aiohttp
-import aiofiles
-import shutil
+from http_utils import FetchError
+from cache_utils import file_hash
+from artifact_utils import pdf_artifact_store, link_or_copy
+from janitor_utils import file_pins
+from lock_utils import KeyedLocks
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 按 PDF 內容哈希加鎖 : 多個條目引用同一份 PDF 時只渲染一次
+_render_locks = KeyedLocks()
+
+
+def _accept_pdf(url):
+    """返回判斷響應是否為 PDF 的函數 : content-type 不含 pdf 時,只接受以 .pdf 結尾的 URL"""
+    return lambda content_type: 'pdf' in content_type or url.lower().endswith('.pdf')
+
+
 async def download_pdf(url, output_filename):
     """
-    從URL下載PDF文件並保存到本地 : 當前主要是用來下載來源為CDPH的PDF文件
+    從URL下載PDF文件並保存到本地 : 當前主要是用來下載來源為CDPH和HK的PDF文件
+
+    經由按內容尋址的 pdf_artifact_store 下載(已知的 URL 發送條件請求,內容未變化時不再下載),
+    並發、重試退避、超時與大小限制由 http_utils.HOST_POLICIES 中對應主機的策略決定;output_filename 為存儲中文件的硬鏈接
 
     Args:
         url (str): PDF文件的URL
@@ -27,37 +40,23 @@ async def download_pdf(url, output_filename):
     Returns:
         str/bool: 下載成功返回文件路徑，失敗返回False
     """
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Accept': 'application/pdf,*/*'
+    }
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'application/pdf,*/*'
-        }
-        
-        logger.info(f"正在使用 requests 下載PDF: {url}")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, ssl=False) as response:
-                if response.status != 200:
-                    raise Exception(f"下載失敗，狀態碼: {response.status}")
-                    
-                content_type = response.headers.get('content-type', '')
-                if 'pdf' not in content_type.lower() and not url.lower().endswith('.pdf'):
-                    raise Exception(f"下載的不是PDF文件，content-type: {content_type}")
-                    
-                content = await response.read()
-                async with aiofiles.open(output_filename, 'wb') as f:
-                    await f.write(content)
-                    
-                logger.info(f"PDF文件已成功保存為: {output_filename}")
-                return output_filename
-        
-    except Exception as e:
+        logger.info(f"正在下載PDF: {url}")
+        await pdf_artifact_store.fetch_to(url, output_filename, headers=headers, accept=_accept_pdf(url))
+        logger.info(f"PDF文件已成功保存為: {output_filename}")
+        return output_filename
+    except FetchError as e:
         logger.error(f"下載PDF時發生錯誤: {str(e)}")
         return False
 
 
 async def download_pdf_for_fsis_and_fsa(url, output_filename):
     """
-    下載來源為FSIS和FSA的內置圖片的PDF文件 : 使用 curl_cffi 從URL下載PDF文件，可以有效繞過TLS指紋檢測
+    下載來源為FSIS和FSA的內置圖片的PDF文件 : 這兩個主機的策略使用 curl_cffi 模擬瀏覽器 TLS 指紋，可以有效繞過TLS指紋檢測
     
     Args:
         url (str): PDF文件的URL
@@ -66,41 +65,15 @@ async def download_pdf_for_fsis_and_fsa(url, output_filename):
     Returns:
         str/bool: 下載成功返回PDF文件名的路徑,失敗則返回False
     """
-    max_retries = 3
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            if retry_count > 0:
-                logger.info(f"\n第 {retry_count} 次重試下載...")
-                wait_time = retry_count * 2 + random.uniform(1, 3)
-                logger.info(f"等待 {wait_time:.1f} 秒後重試...")
-                await asyncio.sleep(wait_time)
-            
-            logger.info(f"正在使用 curl_cffi 下載PDF: {url}")
+    try:
+        logger.info(f"正在使用 curl_cffi 下載PDF: {url}")
+        await pdf_artifact_store.fetch_to(url, output_filename)
+        logger.info(f"PDF文件已成功保存為: {output_filename}")
+        return output_filename
+    except FetchError as e:
+        logger.error(f"下載時發生錯誤: {e}")
+        return False
 
-            response = cffi_requests.get(
-                url, 
-                impersonate="chrome120",
-                timeout=5
-            )
-            
-            response.raise_for_status()
-                
-            async with aiofiles.open(output_filename, 'wb') as f:
-                await f.write(response.content)
-                
-            logger.info(f"PDF文件已成功保存為: {output_filename}")
-            return output_filename
-            
-        except Exception as e:
-            retry_count += 1
-            logger.error(f"下載時發生錯誤: {type(e).__name__} - {e}")
-            if retry_count >= max_retries:
-                logger.info(f"已達到最大重試次數({max_retries})，放棄下載。")
-                return False
-            else:
-                logger.info("下載准備重試...")
 
 async def process_pdf_with_extractor(global_id: str, pdf_url: str, pdf_dir: str, images_dir: str) -> bool:
     """
@@ -110,7 +83,7 @@ async def process_pdf_with_extractor(global_id: str, pdf_url: str, pdf_dir: str,
         global_id (str): 帖子ID(全局)，用於生成圖片文件名
         pdf_url (str): 需要下載的PDF文件對應的URL
         pdf_dir (str): 下載好的PDF文件保存目錄
-        images_dir (str): 轉換後的PNG圖片保存目錄
+        images_dir (str): 轉換後的圖片保存目錄(PDF_RENDER_MODE 為 thumbnail 時為 JPEG,full 時為 PNG)
 
     Returns:
         bool: 處理成功返回True，失敗返回False
@@ -120,11 +93,11 @@ async def process_pdf_with_extractor(global_id: str, pdf_url: str, pdf_dir: str,
         os.makedirs(pdf_dir, exist_ok=True)
         os.makedirs(images_dir, exist_ok=True)
 
-        # 檢查最終產物（第一張圖片）是否存在
-        expected_image_path = os.path.join(images_dir, f"{global_id}_1.png")
-        if os.path.exists(expected_image_path):
-            logger.info(f"目標: {global_id}已存在,跳過相關PDF和圖片處理")
-            return True
+        # 檢查最終產物（第一張圖片）是否存在 : 兩種渲染模式輸出的 .png / .jpg 均視為已存在
+        for ext in ("png", "jpg"):
+            if os.path.exists(os.path.join(images_dir, f"{global_id}_1.{ext}")):
+                logger.info(f"目標: {global_id}已存在,跳過相關PDF和圖片處理")
+                return True
 
         # 如果圖片不存在，則繼續執行完整流程
         pdf_filename = os.path.join(pdf_dir, f"{global_id}.pdf")
@@ -138,56 +111,41 @@ async def process_pdf_with_extractor(global_id: str, pdf_url: str, pdf_dir: str,
         else:
             logger.info(f"PDF文件已存在，跳過下載: {pdf_filename}")
 
-        # 2. 調用 PDFImageExtractor 轉換圖片
-        extractor = PDFImageExtractor(images_dir)
-        pdf_url_local = f"file:///{os.path.abspath(pdf_filename).replace(os.sep, '/')}"
-        
-        # 轉換器
-        results = extractor.process_pdf_urls([pdf_url_local])
+        # 2. 頁面圖片以 PDF 的內容哈希為鍵保存在存儲中 : 內容相同的 PDF(不同條目/URL引用同一份文件)只轉換一次
+        digest = await asyncio.to_thread(pdf_artifact_store.add_file, pdf_filename)
+        # 存儲中的文件以內容哈希命名,不含 globalId : 在轉換和鏈接完成之前固定哈希,避免被清理任務淘汰
+        with file_pins.pinned([digest]):
+            ext = render_ext(PDF_RENDER_MODE)
+            async with _render_locks.hold(digest):
+                page_paths = pdf_artifact_store.derived_pages(digest, ext)
+                if page_paths:
+                    logger.info(f"PDF {digest[:12]} 的頁面圖片已存在,跳過轉換")
+                else:
+                    # 轉換器直接讀取存儲中的 PDF,輸出的 {digest}_{頁碼}.{ext} 即為派生圖片;頁面在進程池中並行渲染,不阻塞事件循環
+                    blob_path = pdf_artifact_store.blob_path(digest)
+                    extractor = PDFImageExtractor(pdf_artifact_store.derived_dir, render_mode=PDF_RENDER_MODE)
+                    page_paths = await extractor.convert_pdf_to_images_async(blob_path)
+                    # 渲染失敗的頁面會被跳過 : 只有全部頁面都成功時才記錄總頁數,否則下次重新渲染
+                    total_pages = await asyncio.to_thread(page_count, blob_path)
+                    if page_paths and len(page_paths) == total_pages:
+                        pdf_artifact_store.record_pages(digest, total_pages)
+                    elif page_paths:
+                        logger.warning(f"PDF {digest[:12]} 只渲染成功 {len(page_paths)}/{total_pages} 頁,不緩存本次結果")
 
-        if results['success']:
-            pdf_result = results['success'][0]
+            if not page_paths:
+                logger.error("處理PDF轉換圖片的過程失敗，未生成任何圖片。")
+                return False
 
-            # 3. 遍歷轉換後的圖片路徑並重命名
-            for i, img_path in enumerate(pdf_result['image_paths'], 1):
-                # 確保源文件存在
-                if not os.path.exists(img_path):
-                    logger.warning(f"轉換器聲稱成功，但找不到文件: {img_path}")
-                    continue
-                
-                # 設置目標文件名和路徑
-                new_filename = f"{global_id}_{i}.png"
-                new_path = os.path.join(images_dir, new_filename)
-                
+            # 3. 以 {global_id}_{頁碼}.{ext} 的文件名鏈接到圖片目錄
+            for i, img_path in enumerate(page_paths, 1):
                 try:
-                    # 如果源文件和目標文件是同一個文件，則跳過
-                    if os.path.samefile(img_path, new_path):
-                        logger.debug(f"源文件和目標文件相同，跳過移動: {img_path}")
-                        continue
-                        
-                    # 如果目標文件已存在，先刪除
-                    if os.path.exists(new_path):
-                        os.remove(new_path)
-                    
-                    # 使用 shutil.move 進行重命名
-                    shutil.move(img_path, new_path)
-                except FileNotFoundError:
-                    logger.warning(f"移動文件時出現錯誤，源文件可能已被移動: {img_path}")
-                    continue
+                    link_or_copy(img_path, os.path.join(images_dir, f"{global_id}_{i}.{ext}"))
                 except Exception as e:
-                    logger.error(f"移動文件時出現未預期的錯誤: {str(e)}")
+                    logger.error(f"放置圖片時出現未預期的錯誤: {str(e)}")
                     continue
 
-            logger.info(f"成功為 {global_id} 轉換並重命名了 {len(pdf_result['image_paths'])} 張圖片。")
-            return True
-        else:
-            # 錯誤信息記錄
-            error_info = results.get('failed')
-            if error_info:
-                logger.error(f"處理PDF轉換圖片的過程失敗: {error_info[0].get('error', '未知錯誤')}")
-            else:
-                logger.error("處理PDF轉換圖片的過程失敗，且沒有返回詳細錯誤信息。")
-            return False
+        logger.info(f"成功為 {global_id} 轉換並放置了 {len(page_paths)} 張圖片。")
+        return True
 
     except Exception as e:
         logger.error(f"處理PDF轉換圖片時發生嚴重錯誤: {str(e)}", exc_info=True)
@@ -209,6 +167,13 @@ def convert_pdf_to_image(pdf_path, output_dir, output_format='jpg', dpi=200):
     try:
         os.makedirs(output_dir, exist_ok=True)
         pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+        output_path = os.path.join(output_dir, f"{pdf_name}.{output_format}")
+
+        # 轉換結果以 PDF 的內容哈希和 DPI 為鍵保存在存儲中,內容相同的 PDF 不再重複轉換
+        cached_path = pdf_artifact_store.derived_path(file_hash(pdf_path), f"page1_{dpi}dpi.{output_format}")
+        if os.path.exists(cached_path):
+            pdf_artifact_store.touch(cached_path)
+            return link_or_copy(cached_path, output_path)
         
         pdf_document = fitz.open(pdf_path)
         
@@ -220,15 +185,13 @@ def convert_pdf_to_image(pdf_path, output_dir, output_format='jpg', dpi=200):
         page = pdf_document[0]
         pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
         
-        output_path = os.path.join(output_dir, f"{pdf_name}.{output_format}")
-        
         if output_format.lower() == 'jpg':
-            pix.save(output_path, "jpeg")
+            pix.save(cached_path, "jpeg")
         else:
-            pix.save(output_path, "png")
+            pix.save(cached_path, "png")
         
         pdf_document.close()
-        return output_path
+        return link_or_copy(cached_path, output_path)
         
     except Exception as e:
         return "" 
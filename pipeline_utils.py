@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PipelineStage:
+    """
+    流水線中的一個異步階段
+
+    Args:
+        name (str): 階段名稱,同時作為其結果在 `results` 中的鍵
+        func (callable): async def func(results) -> Any,results 為已完成階段的結果 {階段名稱: 結果}
+        deps (iterable): 依賴的階段名稱
+        progress (int): 可選,階段開始時回報的進度百分比
+    """
+
+    def __init__(self, name: str, func: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 deps: Iterable[str] = (), progress: Optional[int] = None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.progress = progress
+
+
+class Pipeline:
+    """
+    以依賴圖表示的異步流水線 : 所有依賴已完成的階段會立即並發執行,端到端耗時趨近於最長路徑而不是各階段之和
+
+    任一階段拋出異常時,取消其餘正在執行的階段並向上拋出該異常
+    """
+
+    def __init__(self, progress_callback: Optional[Callable[[str, int], None]] = None):
+        self.stages: Dict[str, PipelineStage] = {}
+        self.progress_callback = progress_callback
+        self._progress = 0
+
+    def stage(self, name: str, deps: Iterable[str] = (), progress: Optional[int] = None):
+        """裝飾器 : 將 async def func(results) 註冊為流水線階段"""
+        def decorator(func):
+            self.add(PipelineStage(name, func, deps, progress))
+            return func
+        return decorator
+
+    def add(self, stage: PipelineStage):
+        if stage.name in self.stages:
+            raise ValueError(f"流水線階段重複: {stage.name}")
+        self.stages[stage.name] = stage
+
+    def _validate(self):
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"流水線階段 {stage.name} 依賴未知的階段: {dep}")
+
+        # 檢查環 : 反覆移除沒有未完成依賴的階段
+        remaining = {name: set(stage.deps) for name, stage in self.stages.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"流水線存在循環依賴: {sorted(remaining)}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def _report(self, stage: PipelineStage):
+        if self.progress_callback is None or stage.progress is None:
+            return
+        # 並發階段的開始順序不固定,回報的進度只增不減
+        self._progress = max(self._progress, stage.progress)
+        try:
+            self.progress_callback(stage.name, self._progress)
+        except Exception as e:
+            logger.warning(f"回報進度時出錯: {str(e)}")
+
+    async def _run_stage(self, stage: PipelineStage, results: Dict[str, Any]):
+        self._report(stage)
+        start = time.perf_counter()
+        result = await stage.func(results)
+        logger.info(f"流水線階段 {stage.name} 完成,耗時 {time.perf_counter() - start:.2f} 秒")
+        return result
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        執行流水線
+
+        Returns:
+            dict: {階段名稱: 結果}
+        """
+        self._validate()
+        results: Dict[str, Any] = {}
+        pending = dict(self.stages)
+        running: Dict[asyncio.Task, str] = {}
+
+        try:
+            while pending or running:
+                for name in [name for name, stage in pending.items() if all(dep in results for dep in stage.deps)]:
+                    stage = pending.pop(name)
+                    running[asyncio.create_task(self._run_stage(stage, results))] = name
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    results[name] = task.result()  # 階段出錯時在此拋出
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        return results